@@ -0,0 +1,265 @@
+import json
+import os
+import re
+import time
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+# Description-based matching of items the lists code differently (own codes,
+# no EAN). Descriptions are split into tokens weighted by rarity; candidate
+# pairs come from an index of each description's rarest tokens (prefix
+# filtering, so no all-pairs comparison) and are scored with the weighted
+# Jaccard similarity. Confirmed matches become item aliases of the comparison.
+
+DEFAULT_MATCHES_FILE = 'description_matches.json'
+MATCH_THRESHOLD = 0.7  # lowest similarity proposed
+MAX_BLOCK = 1000  # index tokens shared by more items than this are skipped (too generic to block on)
+PAIR_BATCH = 500000  # candidate pairs generated at a time
+SCORE_BATCH = 50000  # candidate pairs scored at a time
+_TOKEN = re.compile(r'[a-z0-9]+(?:[.,][0-9]+)?')
+
+
+def description_tokens(text):
+    """Distinct lower-case tokens of a description, accents removed ('Vite M8x20 inox' -> m8x20, inox, vite)."""
+    if not isinstance(text, str):
+        return []
+    text = unicodedata.normalize('NFKD', text.lower()).encode('ascii', 'ignore').decode('ascii')
+    return sorted(set(_TOKEN.findall(text)))
+
+
+class TokenTable:
+    """
+    One row per (item, token) of the descriptions, rows grouped by item, each
+    token weighted by its inverse document frequency (rare tokens count more).
+    """
+
+    def __init__(self, descriptions):
+        tokens = pd.Series([description_tokens(d) for d in descriptions], dtype=object).explode().dropna()
+        self.n_docs = len(descriptions)
+        self.doc = tokens.index.to_numpy(dtype=np.int64)
+        token, vocabulary = pd.factorize(tokens.to_numpy(dtype=object))
+        self.token = token.astype(np.int64)
+        self.n_tokens = max(len(vocabulary), 1)
+        self.frequency = np.bincount(self.token, minlength=len(vocabulary))
+        self.weight = np.log((self.n_docs + 1) / self.frequency)[self.token] + 1.0
+        self.counts = np.bincount(self.doc, minlength=self.n_docs)
+        self.starts = np.cumsum(self.counts) - self.counts
+        self.total = np.bincount(self.doc, weights=self.weight, minlength=self.n_docs)
+        self.keys = np.sort(self.doc * self.n_tokens + self.token)
+
+    def __len__(self):
+        return len(self.doc)
+
+    def similarity(self, a, b):
+        """Weighted Jaccard of the item pairs (a, b): weight of the shared tokens over the weight of their union."""
+        counts = self.counts[a]
+        pair = np.repeat(np.arange(len(a)), counts)
+        # Every token row of each pair's a item, looked up among b's (item, token) keys
+        rows = np.repeat(self.starts[a] - (np.cumsum(counts) - counts), counts) + np.arange(len(pair))
+        wanted = b[pair] * self.n_tokens + self.token[rows]
+        position = np.minimum(np.searchsorted(self.keys, wanted), max(len(self.keys) - 1, 0))
+        shared = np.bincount(pair, weights=np.where(self.keys[position] == wanted, self.weight[rows], 0.0),
+                             minlength=len(a))
+        return shared / (self.total[a] + self.total[b] - shared)
+
+
+def _prefix_rows(table, threshold):
+    """
+    Rows of the token table in each item's prefix: its rarest tokens until
+    the rest weighs less than threshold x the item's weight. Two items with a
+    weighted Jaccard >= threshold always share a token of both prefixes.
+    Returns (doc, token, remaining): remaining is the weight of the item's
+    tokens from that row on, an upper bound of the overlap of any pair whose
+    first shared token it is.
+    """
+    # Global order: rarest first, ties by token id
+    order = np.lexsort((table.token, table.frequency[table.token], table.doc))
+    doc, token, weight = table.doc[order], table.token[order], table.weight[order]
+    total = np.bincount(doc, weights=weight)
+    cumulative = np.cumsum(weight)
+    counts = np.bincount(doc, minlength=len(total))
+    before_item = np.repeat(np.cumsum(total) - total, counts)
+    # Weight from this row to the end of its item, this row included
+    remaining = total[doc] - (cumulative - weight - before_item)
+    in_prefix = remaining >= threshold * total[doc] - 1e-9
+    return doc[in_prefix], token[in_prefix], remaining[in_prefix]
+
+
+def iter_candidate_pairs(doc, token, remaining, max_block=MAX_BLOCK, batch_pairs=PAIR_BATCH):
+    """
+    Yield arrays (a, b, bound) of item pairs sharing an index token used by
+    at most max_block items, about batch_pairs pairs at a time so memory
+    stays bounded. A pair sharing several tokens comes once per shared
+    token; bound is the lower remaining weight of the two at that token.
+    """
+    order = np.lexsort((doc, token))
+    doc, token, remaining = doc[order], token[order], remaining[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(token)) + 1]
+    sizes = np.diff(np.r_[starts, len(token)])
+    usable = (sizes > 1) & (sizes <= max_block)
+    starts, sizes = starts[usable], sizes[usable]
+    # Whole blocks per batch, cut where the running pair count passes batch_pairs
+    pair_counts = sizes * (sizes - 1) // 2
+    batches = np.cumsum(pair_counts) // batch_pairs
+    for batch in np.unique(batches):
+        block_starts, block_sizes = starts[batches == batch], sizes[batches == batch]
+        # Each row of a block pairs with the rows after it in the same block
+        rows = np.repeat(block_starts, block_sizes) + _ranges(block_sizes)
+        partners = np.repeat(block_sizes, block_sizes) - 1 - _ranges(block_sizes)
+        first = np.repeat(rows, partners)
+        second = first + 1 + _ranges(partners)
+        yield doc[first], doc[second], np.minimum(remaining[first], remaining[second])
+
+
+def _ranges(lengths):
+    # 0..n-1 for each n in lengths, concatenated
+    return np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+
+def find_description_matches(best, supplier_prices, threshold=MATCH_THRESHOLD, max_block=MAX_BLOCK, rejected=()):
+    """
+    Pairs of items of the best-offers frame whose descriptions are at least
+    threshold similar and that no list has both of (a supplier does not list
+    one product twice). rejected holds (key_a, key_b) pairs not to propose.
+    Returns a frame sorted by similarity: key_a, item_a, description_a,
+    key_b, item_b, description_b, similarity, plus group (items linked by
+    the pairs) and group_confidence (the lowest similarity in the group).
+    """
+    columns = ['key_a', 'item_a', 'description_a', 'key_b', 'item_b', 'description_b', 'similarity', 'group',
+               'group_confidence']
+    if len(best) < 2:
+        return pd.DataFrame(columns=columns)
+    table = TokenTable(best['description'].to_numpy(dtype=object))
+    if not len(table):
+        return pd.DataFrame(columns=columns)
+    listed = ~np.isnan(supplier_prices.prices)
+    total = table.total
+    found_a, found_b, found = [], [], []
+    for a, b, bound in iter_candidate_pairs(*_prefix_rows(table, threshold), max_block=max_block):
+        # Jaccard >= threshold needs an overlap of threshold / (1 + threshold) x both weights; the copy
+        # of a pair made at its first shared token has the highest bound, so no match is lost
+        keep = bound >= threshold / (1 + threshold) * (total[a] + total[b]) - 1e-9
+        if listed.shape[1]:
+            keep &= ~(listed[a] & listed[b]).any(axis=1)
+        a, b = a[keep], b[keep]
+        for start in range(0, len(a), SCORE_BATCH):
+            part_a, part_b = a[start:start + SCORE_BATCH], b[start:start + SCORE_BATCH]
+            similarity = table.similarity(part_a, part_b)
+            keep = similarity >= threshold - 1e-9
+            found_a.append(part_a[keep])
+            found_b.append(part_b[keep])
+            found.append(similarity[keep])
+    if not found:
+        return pd.DataFrame(columns=columns)
+    pair_keys, first = np.unique(np.concatenate(found_a) * (1 << 32) + np.concatenate(found_b), return_index=True)
+    a, b, similarity = pair_keys >> 32, pair_keys & ((1 << 32) - 1), np.concatenate(found)[first]
+    keys = best['item_key'].astype(object).to_numpy(dtype=object)
+    if len(rejected):
+        skip = {(x, y) for x, y in rejected} | {(y, x) for x, y in rejected}
+        keep = np.array([(x, y) not in skip for x, y in zip(keys[a], keys[b])], dtype=bool)
+        a, b, similarity = a[keep], b[keep], similarity[keep]
+    items = best['original_item'].to_numpy(dtype=object)
+    descriptions = best['description'].to_numpy(dtype=object)
+    matches = pd.DataFrame({'key_a': keys[a], 'item_a': items[a], 'description_a': descriptions[a],
+                            'key_b': keys[b], 'item_b': items[b], 'description_b': descriptions[b],
+                            'similarity': np.round(similarity, 3)})
+    roots = _components(a, b)
+    matches['group'] = pd.factorize(roots)[0]
+    matches['group_confidence'] = matches.groupby('group')['similarity'].transform('min')
+    order = np.lexsort((-matches['similarity'].to_numpy(), -matches['group_confidence'].to_numpy()))
+    return matches.iloc[order].reset_index(drop=True)[columns]
+
+
+def _components(a, b):
+    # Union-find over the pairs; returns the root of each pair
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    for x, y in zip(a.tolist(), b.tolist()):
+        rx, ry = find(x), find(y)
+        if rx != ry:
+            parent[max(rx, ry)] = min(rx, ry)
+    return np.array([find(x) for x in a.tolist()], dtype=np.int64)
+
+
+def match_groups(pairs):
+    """{key: group key} for confirmed (key_a, key_b) pairs; each group is named after its first key."""
+    first = {}
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    for x, y in pairs:
+        for key in (x, y):
+            first.setdefault(key, len(first))
+        rx, ry = find(x), find(y)
+        if rx != ry:
+            if first[rx] > first[ry]:
+                rx, ry = ry, rx
+            parent[ry] = rx
+    return {key: find(key) for key in parent if find(key) != key}
+
+
+class MatchDecisions:
+    """
+    Matches confirmed or rejected by the user, in a JSON file keyed by item
+    key pairs; the confirmed ones are applied to later comparisons as item
+    aliases, the rejected ones are not proposed again.
+    """
+
+    def __init__(self, path=DEFAULT_MATCHES_FILE):
+        self.path = path
+        self.confirmed = {}  # (key_a, key_b) -> {'similarity', 'saved'}
+        self.rejected = set()
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.confirmed = {(m['key_a'], m['key_b']): m for m in data.get('confirmed', [])}
+                self.rejected = {tuple(pair) for pair in data.get('rejected', [])}
+            except (OSError, ValueError, KeyError, TypeError):
+                self.confirmed, self.rejected = {}, set()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('description_matches_file') or DEFAULT_MATCHES_FILE)
+
+    def status(self, key_a, key_b):
+        if (key_a, key_b) in self.confirmed or (key_b, key_a) in self.confirmed:
+            return 'confirmed'
+        if (key_a, key_b) in self.rejected or (key_b, key_a) in self.rejected:
+            return 'rejected'
+        return None
+
+    def confirm(self, key_a, key_b, similarity=None):
+        self.rejected.discard((key_a, key_b))
+        self.rejected.discard((key_b, key_a))
+        self.confirmed[(key_a, key_b)] = {'key_a': key_a, 'key_b': key_b, 'similarity': similarity,
+                                          'saved': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+    def reject(self, key_a, key_b):
+        self.confirmed.pop((key_a, key_b), None)
+        self.confirmed.pop((key_b, key_a), None)
+        self.rejected.add((key_a, key_b))
+
+    def clear(self):
+        self.confirmed, self.rejected = {}, set()
+
+    def aliases(self):
+        return match_groups(self.confirmed)
+
+    def save(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'confirmed': list(self.confirmed.values()), 'rejected': [list(pair) for pair in self.rejected]},
+                      f, indent=2, ensure_ascii=False)
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import math
+import os
+import re
+import time
+
+# Header-row and column detection for the supplier price lists, and the saved
+# mapping profiles: a confirmed mapping is stored under the fingerprint of its
+# header row and applied again to any list with the same header layout.
+
+DEFAULT_PROFILES_FILE = 'mapping_profiles.json'
+DETECT_ROWS = 20  # rows scanned for the header, like the preview of the mapping dialog
+BODY_ROWS = 15  # data rows under a candidate header used to score its columns
+AUTO_CONFIDENCE = 0.75  # a detected mapping at least this confident is applied without asking
+MAPPING_COLUMNS = ('item_col', 'price_col', 'description_col')
+ITEM_KEYWORDS = ('ean', 'cod', 'articolo', 'art', 'sku', 'item', 'code', 'barcode', 'gtin', 'ref')
+PRICE_KEYWORDS = ('prezzo', 'prezzi', 'price', 'netto', 'listino', 'importo', 'costo', 'cost', 'eur', '€', 'prz')
+DESCRIPTION_KEYWORDS = ('descrizione', 'description', 'desc', 'denominazione', 'prodotto', 'product', 'nome', 'name')
+_NUMBER_TEXT = re.compile(r'^\s*(?:€|\$|£|eur|usd)?\s*[+-]?\d[\d.,\s]*(?:€|\$|£|eur|usd)?\s*$', re.IGNORECASE)
+
+
+def is_blank(value):
+    return value is None or (isinstance(value, float) and math.isnan(value)) or (isinstance(value, str) and not value.strip())
+
+
+def cell_label(value):
+    # Same labels as the mapping dialog and the reader: str() of the cell, blanks as 'nan'
+    return 'nan' if value is None or (isinstance(value, float) and math.isnan(value)) else str(value)
+
+
+def _normalized(value):
+    return '' if is_blank(value) else ' '.join(str(value).lower().split())
+
+
+def header_fingerprint(row):
+    """Hash of the normalized header labels in column order, trailing blanks ignored."""
+    labels = [_normalized(value) for value in row]
+    while labels and not labels[-1]:
+        labels.pop()
+    return hashlib.sha1(json.dumps(labels, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+
+def _keyword_hit(label, keywords):
+    return any(word.startswith(keyword) for word in re.findall(r'[a-z€]+', label.lower()) for keyword in keywords)
+
+
+def _is_number(value):
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, (int, float)):
+        return not math.isnan(value)
+    return isinstance(value, str) and bool(_NUMBER_TEXT.match(value))
+
+
+def _looks_like_price(value):
+    # EAN codes are numbers too, but long integers
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return abs(value) < 1000000
+    return _is_number(value) and len(re.sub(r'\D', '', value)) <= 9
+
+
+def _column_scores(label, values):
+    """(item, price, description) scores in 0-1 for a column: 0.6 from its data, 0.4 from its label."""
+    filled = [v for v in values if not is_blank(v)]
+    if not filled:
+        return 0.0, 0.0, 0.0
+    texts = [str(v).strip() for v in filled]
+    price = sum(_looks_like_price(v) for v in filled) / len(filled)
+    distinct = len(set(texts)) / len(texts)
+    codes = sum(' ' not in t and len(t) <= 25 for t in texts) / len(texts)
+    words = [t for v, t in zip(filled, texts) if isinstance(v, str) and not _is_number(v)]
+    description = (sum(' ' in t for t in words) / len(texts)) * min(sum(len(t) for t in words) / max(len(words), 1) / 20, 1)
+    # A column of short decimals is a price, not a code
+    item = distinct * codes * (1 - 0.7 * price * (1 - sum(isinstance(v, int) for v in filled) / len(filled)))
+    fill = len(filled) / len(values)
+    return tuple(fill * (0.6 * score + 0.4 * _keyword_hit(label, keywords))
+                 for score, keywords in ((item, ITEM_KEYWORDS), (price, PRICE_KEYWORDS), (description, DESCRIPTION_KEYWORDS)))
+
+
+def _score_header(rows, header_idx):
+    header = list(rows[header_idx])
+    body = [list(row) for row in rows[header_idx + 1:header_idx + 1 + BODY_ROWS]]
+    labels = [cell_label(value) for value in header]
+    # The reader finds a label by its first column, so repeated labels are candidates once
+    named = [i for i, value in enumerate(header)
+             if not is_blank(value) and not _is_number(value) and labels.index(labels[i]) == i]
+    if len(named) < 2 or not body:
+        return None
+    filled = [value for value in header if not is_blank(value)]
+    scores = {i: _column_scores(labels[i], [row[i] if i < len(row) else None for row in body]) for i in named}
+    price_col = max(named, key=lambda i: scores[i][1])
+    others = [i for i in named if i != price_col]
+    item_col = max(others, key=lambda i: scores[i][0])
+    rest = [i for i in others if i != item_col]
+    description_col = max(rest, key=lambda i: scores[i][2]) if rest else item_col
+    description_score = scores[description_col][2] if rest else 0.0
+    if rest and description_score < 0.2:
+        # No description column: describe the item with its code, like the dialog's default
+        description_col, description_score = item_col, 0.2
+    confidence = (0.25 * len(named) / len(filled) + 0.3 * scores[price_col][1]
+                  + 0.3 * scores[item_col][0] + 0.15 * description_score)
+    return {'header_idx': header_idx, 'item_col': labels[item_col], 'price_col': labels[price_col],
+            'description_col': labels[description_col], 'confidence': round(min(confidence, 1.0), 3)}
+
+
+def detect_mapping(rows):
+    """
+    Score the first DETECT_ROWS rows as header candidates and their columns
+    from the labels and the data underneath. Returns the best mapping
+    (header_idx, item_col, price_col, description_col, confidence 0-1), or
+    None if no row looks like a header.
+    """
+    rows = list(rows)
+    candidates = [_score_header(rows, r) for r in range(min(len(rows), DETECT_ROWS))]
+    candidates = [c for c in candidates if c is not None]
+    return max(candidates, key=lambda c: c['confidence']) if candidates else None
+
+
+def match_profile(rows, profiles):
+    """The saved profile whose header fingerprint is one of the first rows, with that row as header_idx."""
+    if not profiles:
+        return None
+    for header_idx, row in enumerate(list(rows)[:DETECT_ROWS]):
+        profile = profiles.get(header_fingerprint(row))
+        if profile is None:
+            continue
+        labels = [cell_label(value) for value in row]
+        if all(profile[key] in labels for key in MAPPING_COLUMNS):
+            return {'header_idx': header_idx, **{key: profile[key] for key in MAPPING_COLUMNS},
+                    'confidence': 1.0, 'profile': profile.get('name')}
+    return None
+
+
+def auto_mapping(rows, profiles=None, min_confidence=AUTO_CONFIDENCE):
+    """A saved profile matching the rows, else a detected mapping at least min_confidence confident, else None."""
+    rows = list(rows)
+    mapping = match_profile(rows, profiles)
+    if mapping is None:
+        mapping = detect_mapping(rows)
+        if mapping is None or mapping['confidence'] < min_confidence:
+            return None
+    return mapping
+
+
+class MappingProfiles:
+    """
+    Confirmed mappings in a JSON file, {fingerprint: {name, header, item_col,
+    price_col, description_col, saved}}; the header row is found again by its
+    fingerprint, so a supplier adding a title row keeps its profile.
+    """
+
+    def __init__(self, path=DEFAULT_PROFILES_FILE):
+        self.path = path
+        self.profiles = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.profiles = json.load(f)
+            except (OSError, ValueError):
+                self.profiles = {}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('mapping_profiles_file') or DEFAULT_PROFILES_FILE)
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def match(self, rows):
+        return match_profile(rows, self.profiles)
+
+    def remember(self, rows, mapping, name):
+        """Save mapping under the fingerprint of its header row (rows[mapping['header_idx']])."""
+        header = list(rows)[mapping['header_idx']]
+        self.profiles[header_fingerprint(header)] = {
+            'name': name, 'header': [cell_label(value) for value in header],
+            **{key: mapping[key] for key in MAPPING_COLUMNS}, 'saved': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        self.save()
+
+    def clear(self):
+        self.profiles = {}
+        self.save()
+
+    def save(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(self.profiles, f, indent=2, ensure_ascii=False)
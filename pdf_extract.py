@@ -0,0 +1,215 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+import pandas as pd
+
+from price_compare_engine import ComparisonCancelled, resolve_worker_count
+from price_list_cache import content_digest
+
+# Table extraction from PDF price lists with camelot, shared by the PDF
+# converter and by the comparison, which reads the tables of a PDF like the
+# rows of a sheet. With a PriceListCache every page is stored as soon as it
+# is extracted: an interrupted run resumes where it stopped and a PDF already
+# extracted does not start camelot at all.
+
+CAMELOT_FLAVOR = 'stream'
+# Pages handed to a worker at once: camelot reopens the PDF on every call
+PAGES_PER_TASK = 5
+# Pages extracted for the mapping dialog preview
+PREVIEW_PAGES = 3
+# Sheet layouts of write_tables_xlsx
+SHEET_LAYOUTS = ('single', 'table', 'page')
+MAX_SHEET_NAME = 31
+
+
+def count_pages(pdf_path):
+    import PyPDF2
+    with open(pdf_path, 'rb') as f:
+        return len(PyPDF2.PdfReader(f).pages)
+
+
+def cached_page_count(pdf_path, cache=None, digest=None):
+    if cache is None:
+        return count_pages(pdf_path)
+    count = cache.load_pdf_page_count(digest)
+    if count is None:
+        count = count_pages(pdf_path)
+        cache.store_pdf_page_count(digest, count)
+    return count
+
+
+def _page_spec(pages):
+    return ','.join(str(page) for page in pages)
+
+
+def extract_pages(pdf_path, pages, flavor=CAMELOT_FLAVOR):
+    """
+    Tables of some pages as {page: [DataFrame, ...]}, every page of pages
+    present (empty list when it has no table). Runs in a pool process.
+    """
+    import camelot
+    found = {page: [] for page in pages}
+    for table in camelot.read_pdf(pdf_path, pages=_page_spec(pages), flavor=flavor):
+        found.setdefault(int(table.page), []).append(table.df)
+    return found
+
+
+def _extract_pages_or_each(pdf_path, pages, flavor):
+    # One camelot call for the whole group; if it fails, page by page so that
+    # only the broken pages are lost. Returns (found, {page: error message})
+    try:
+        return extract_pages(pdf_path, pages, flavor), {}
+    except Exception:
+        if len(pages) == 1:
+            raise
+    found, failed = {}, {}
+    for page in pages:
+        try:
+            found.update(extract_pages(pdf_path, [page], flavor))
+        except Exception as e:
+            failed[page] = f'{type(e).__name__}: {e}'
+    return found, failed
+
+
+def extract_tables(pdf_path, pages=None, max_workers=None, flavor=CAMELOT_FLAVOR, progress=None, on_error=None,
+                   cache=None, cancel=None, digest=None):
+    """
+    Extract the tables of pages (1-based, default all) in parallel worker
+    processes. Returns [(page, DataFrame), ...] ordered by page, then by
+    position on the page, whatever the order the workers finish in.
+    progress(pages_done, pages_total) is called as groups of pages complete;
+    on_error(page, message) for every page camelot could not read (those
+    pages are not cached, the next run tries them again). If cancel.is_set()
+    becomes true, ComparisonCancelled is raised (the pages done stay cached).
+    """
+    settings = {'flavor': flavor}
+    if cache is not None and digest is None:
+        digest = content_digest(pdf_path)
+    if pages is None:
+        pages = range(1, cached_page_count(pdf_path, cache, digest) + 1)
+    pages = list(pages)
+    by_page = {}
+    pending = []
+    for page in pages:
+        tables = cache.load_pdf_page(digest, page, settings) if cache is not None else None
+        if tables is None:
+            pending.append(page)
+        else:
+            by_page[page] = tables
+    state = {'pages_done': len(pages) - len(pending)}
+    if progress is not None and state['pages_done']:
+        progress(state['pages_done'], len(pages))
+    groups = [pending[i:i + PAGES_PER_TASK] for i in range(0, len(pending), PAGES_PER_TASK)]
+    workers = resolve_worker_count(max_workers, len(groups))
+
+    def collect(group, result):
+        # result() gives the (found, failed) of the group or raises for all of it
+        try:
+            found, failed = result()
+        except Exception as e:
+            found, failed = {}, {page: f'{type(e).__name__}: {e}' for page in group}
+        by_page.update(found)
+        if cache is not None:
+            for page, tables in found.items():
+                cache.store_pdf_page(digest, page, settings, tables)
+        if on_error is not None:
+            for page in group:
+                if page in failed:
+                    on_error(page, failed[page])
+        state['pages_done'] += len(group)
+        if progress is not None:
+            progress(state['pages_done'], len(pages))
+
+    if workers <= 1:
+        for group in groups:
+            if cancel is not None and cancel.is_set():
+                raise ComparisonCancelled()
+            collect(group, lambda: _extract_pages_or_each(pdf_path, group, flavor))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_extract_pages_or_each, pdf_path, group, flavor): group for group in groups}
+            not_done = set(futures)
+            while not_done:
+                done, not_done = wait(not_done, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(futures[future], future.result)
+                if cancel is not None and cancel.is_set():
+                    for future in not_done:
+                        future.cancel()
+                    raise ComparisonCancelled()
+    return [(page, df) for page in sorted(by_page) for df in by_page[page]]
+
+
+def _stacked_rows(tables):
+    # Cells as the sheet readers give them: text, None when blank
+    for _, df in tables:
+        for row in df.itertuples(index=False, name=None):
+            yield tuple(None if value == '' else value for value in row)
+
+
+def pdf_rows(pdf_path, cache=None, max_workers=None, cancel=None):
+    """
+    (row_count, rows) of the tables of a PDF, stacked in page order, for
+    iter_price_list_chunks. Raises ValueError if some pages cannot be read:
+    a price list with missing pages would silently lose its prices.
+    """
+    failed = []
+    tables = extract_tables(pdf_path, max_workers=max_workers, on_error=lambda page, e: failed.append(page),
+                            cache=cache, cancel=cancel)
+    if failed:
+        raise ValueError(f'pagine non leggibili: {", ".join(str(page) for page in failed)}')
+    return sum(len(df) for _, df in tables), _stacked_rows(tables)
+
+
+def pdf_preview(pdf_path, nrows, cache=None):
+    """The first nrows stacked table rows of the first PREVIEW_PAGES pages, blanks as NaN, like read_excel(header=None)."""
+    digest = content_digest(pdf_path) if cache is not None else None
+    pages = range(1, min(PREVIEW_PAGES, cached_page_count(pdf_path, cache, digest)) + 1)
+    rows = []
+    for row in _stacked_rows(extract_tables(pdf_path, pages, cache=cache, digest=digest)):
+        rows.append(row)
+        if len(rows) >= nrows:
+            break
+    if not rows:
+        raise ValueError(f'nessuna tabella nelle prime {PREVIEW_PAGES} pagine')
+    preview = pd.DataFrame(rows, dtype=object)
+    return preview.where(preview.notna(), np.nan)
+
+
+def _sheet_name(layout, page, number):
+    if layout == 'page':
+        return f'Page {page}'
+    return f'Page {page} table {number}'[:MAX_SHEET_NAME]
+
+
+def write_tables_xlsx(path, tables, layout='single', progress=None):
+    """
+    Write [(page, DataFrame), ...] to an .xlsx with a write-only workbook,
+    row by row, so memory does not grow with the number of tables.
+    layout 'single' puts every table in one 'Tables' sheet, each followed by a
+    blank row; 'table' gives each table its own sheet, 'page' each page.
+    progress(tables_done, tables_total) is called after every table.
+    """
+    import openpyxl
+    if layout not in SHEET_LAYOUTS:
+        raise ValueError(f'unknown sheet layout {layout!r}')
+    tables = list(tables)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Tables') if layout == 'single' else None
+    sheet_page = None
+    number = 0
+    for done, (page, df) in enumerate(tables, 1):
+        number = number + 1 if page == sheet_page else 1
+        if layout == 'table' or (layout == 'page' and page != sheet_page):
+            sheet = workbook.create_sheet(_sheet_name(layout, page, number))
+        elif layout == 'page':
+            sheet.append([])  # tables of the same page, separated by a blank row
+        sheet_page = page
+        for row in df.itertuples(index=False, name=None):
+            sheet.append([None if value == '' else value for value in row])
+        if layout == 'single':
+            sheet.append([])
+        if progress is not None:
+            progress(done, len(tables))
+    if sheet is None:
+        workbook.create_sheet('Tables')  # a workbook needs a sheet
+    workbook.save(path)
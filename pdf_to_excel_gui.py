@@ -1,16 +1,37 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-import camelot
-import pandas as pd
+import json
+import os
 import threading
+from pdf_extract import extract_tables, write_tables_xlsx
+from price_list_cache import PriceListCache
+from stage_metrics import StageMetrics
+
+CONFIG_FILE = 'config.json'
+# Export layouts offered in the window -> write_tables_xlsx layout
+SHEET_LAYOUT_LABELS = {'Single sheet': 'single', 'One sheet per table': 'table', 'One sheet per page': 'page'}
 
 class PDFtoExcelApp:
     def __init__(self, root):
         self.root = root
         self.root.title('PDF to Excel Converter')
-        self.tables = []
+        self.tables = []  # (page, DataFrame) in page order
+        self.config = self.load_config()
+        # Extracted pages are kept in the price-list cache (cache_dir / cache_max_mb)
+        self.cache = PriceListCache.from_config(self.config)
+        self.metrics = StageMetrics.from_config(self.config)
         self.setup_ui()
 
+    def load_config(self):
+        # Shares config.json with the price comparison (max_workers: 0 = one per CPU)
+        if os.path.exists(CONFIG_FILE):
+            try:
+                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception:
+                pass
+        return {}
+
     def setup_ui(self):
         frame = ttk.Frame(self.root, padding=10)
         frame.pack(fill=tk.BOTH, expand=True)
@@ -26,6 +47,9 @@ class PDFtoExcelApp:
         self.tables_label = ttk.Label(frame, text='No PDF loaded.')
         self.tables_label.pack(pady=5)
 
+        self.layout_var = tk.StringVar(value='Single sheet')
+        ttk.Combobox(frame, textvariable=self.layout_var, values=list(SHEET_LAYOUT_LABELS), state='readonly').pack(pady=2)
+
         self.export_btn = ttk.Button(frame, text='Export All Tables to Excel', command=self.export_excel, state=tk.DISABLED)
         self.export_btn.pack(pady=5)
 
@@ -33,37 +57,42 @@ class PDFtoExcelApp:
         pdf_path = filedialog.askopenfilename(filetypes=[('PDF Files', '*.pdf')])
         if not pdf_path:
             return
-        # Always use 'stream' flavor and all pages
-        import PyPDF2
-        with open(pdf_path, 'rb') as f:
-            reader = PyPDF2.PdfReader(f)
-            total_pages = len(reader.pages)
-        pages = list(range(1, total_pages + 1))
+        # Always use 'stream' flavor and all pages (counted in the worker thread, cached with the pages)
         self.progress['value'] = 0
-        self.progress['maximum'] = len(pages)
         self.progress_label.config(text='Starting extraction...')
         self.tables_label.config(text='')
         self.export_btn.config(state=tk.DISABLED)
-        threading.Thread(target=self.extract_tables_with_progress, args=(pdf_path, pages), daemon=True).start()
+        threading.Thread(target=self.extract_tables_with_progress, args=(pdf_path,), daemon=True).start()
 
-    def extract_tables_with_progress(self, pdf_path, pages):
-        all_tables = []
-        for idx, page in enumerate(pages):
-            try:
-                tables = camelot.read_pdf(pdf_path, pages=str(page), flavor='stream')
-                all_tables.extend(tables)
-            except Exception as e:
-                pass  # skip errors for individual pages
-            percent = int(((idx + 1) / len(pages)) * 100)
-            self.root.after(0, self.update_progress, idx + 1, len(pages), percent)
-        self.tables = all_tables
-        self.root.after(0, self.show_tables, pdf_path)
+    def extract_tables_with_progress(self, pdf_path, pages=None):
+        # Pages are extracted in a process pool; tables come back in page order
+        failed = []
+        def on_progress(done, total):
+            self.root.after(0, self.update_progress, done, total, int(done / total * 100))
+        try:
+            with self.metrics.stage('pdf_extract', file=os.path.basename(pdf_path)) as record:
+                tables = extract_tables(pdf_path, pages, max_workers=self.config.get('max_workers', 0),
+                                        progress=on_progress, on_error=lambda page, e: failed.append((page, e)),
+                                        cache=self.cache)
+                record['rows'] = sum(len(df) for _, df in tables)
+                record['tables'] = len(tables)
+        except Exception as e:
+            tables = []
+            failed.append(('-', str(e)))
+        self.tables = tables
+        self.root.after(0, self.show_tables, pdf_path, failed)
 
     def update_progress(self, current, total, percent):
+        self.progress['maximum'] = total
         self.progress['value'] = current
         self.progress_label.config(text=f'Processed {current}/{total} pages ({percent}%)')
 
-    def show_tables(self, pdf_path):
+    def show_tables(self, pdf_path, failed=()):
+        if failed:
+            lines = [f'Page {page}: {e}' for page, e in failed[:20]]
+            if len(failed) > 20:
+                lines.append(f'... and {len(failed) - 20} more')
+            messagebox.showwarning('Pages skipped', f'{len(failed)} pages could not be read:\n' + '\n'.join(lines))
         if not self.tables or len(self.tables) == 0:
             self.tables_label.config(text='No tables found.')
             self.progress_label.config(text='Done. No tables found.')
@@ -72,7 +101,7 @@ class PDFtoExcelApp:
         self.pdf_path = pdf_path
         self.tables_label.config(text=f'{len(self.tables)} tables found in {pdf_path.split("/")[-1]}:')
         self.export_btn.config(state=tk.NORMAL)
-        self.progress_label.config(text='Done.')
+        self.progress_label.config(text='Done. ' + self.metrics.describe(self.metrics.records[-1:]))
         self.progress['value'] = self.progress['maximum']
 
     def export_excel(self):
@@ -82,23 +111,37 @@ class PDFtoExcelApp:
         save_path = filedialog.asksaveasfilename(defaultextension='.xlsx', filetypes=[('Excel Files', '*.xlsx')])
         if not save_path:
             return
+        # Written row by row in a worker thread, with a write-only workbook
+        self.export_btn.config(state=tk.DISABLED)
+        self.select_btn.config(state=tk.DISABLED)
+        self.progress['value'] = 0
+        self.progress['maximum'] = len(self.tables)
+        layout = SHEET_LAYOUT_LABELS[self.layout_var.get()]
+        threading.Thread(target=self.export_in_background, args=(save_path, layout), daemon=True).start()
+
+    def export_in_background(self, save_path, layout):
+        def on_progress(done, total):
+            self.root.after(0, self.update_export_progress, done, total)
         try:
-            # Concatenate all tables, separated by a blank row
-            all_dfs = []
-            for table in self.tables:
-                df = table.df
-                all_dfs.append(df)
-                # Add a blank row for separation
-                all_dfs.append(pd.DataFrame([[''] * df.shape[1]], columns=df.columns))
-            if all_dfs:
-                combined_df = pd.concat(all_dfs, ignore_index=True)
-            else:
-                combined_df = pd.DataFrame()
-            with pd.ExcelWriter(save_path, engine='openpyxl') as writer:
-                combined_df.to_excel(writer, sheet_name='Tables', index=False, header=False)
-            messagebox.showinfo('Success', f'All tables exported to {save_path}')
+            with self.metrics.stage('pdf_export', sum(len(df) for _, df in self.tables), layout=layout):
+                write_tables_xlsx(save_path, self.tables, layout, progress=on_progress)
+            error = None
         except Exception as e:
-            messagebox.showerror('Error', f'Failed to export Excel: {e}')
+            error = e
+        self.root.after(0, self.export_done, save_path, error)
+
+    def update_export_progress(self, done, total):
+        self.progress['value'] = done
+        self.progress_label.config(text=f'Exported {done}/{total} tables')
+
+    def export_done(self, save_path, error):
+        self.export_btn.config(state=tk.NORMAL)
+        self.select_btn.config(state=tk.NORMAL)
+        if error is not None:
+            messagebox.showerror('Error', f'Failed to export Excel: {error}')
+            return
+        self.progress_label.config(text='Done. ' + self.metrics.describe(self.metrics.records[-1:]))
+        messagebox.showinfo('Success', f'All tables exported to {save_path}')
 
 if __name__ == '__main__':
     root = tk.Tk()
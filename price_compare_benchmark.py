@@ -0,0 +1,200 @@
+"""
+Benchmark of the price comparison, headless: generates synthetic supplier
+workbooks, times every stage and writes a JSON report that can be compared
+with the report of another version.
+
+    python price_compare_benchmark.py --files 5 --rows 50000 --report bench.json
+    python price_compare_benchmark.py --files 5 --rows 50000 --compare bench.json
+
+The workbooks look like uno.xlsx/due.xlsx/tre.xlsx: an item, a price and a
+description column, filler columns (',,,,') and, for some files, title rows
+above the header. --overlap is the share of each file's items that every
+list has in common, --messy the share of prices written as text such as
+'€ 1.234,50' or ' 12,5 ' (with a few unreadable ones).
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from price_compare_engine import (PriceComparison, iter_price_list_chunks, normalize_offers, price_format,
+                                  read_price_lists, reduce_offers)
+from price_compare_export import load_results_csv, save_compared_csvs, save_temporary_csv
+from results_model import ResultsModel
+from results_search import ResultsSearchIndex
+from results_totals import RunningTotals
+
+REPORT_VERSION = 1
+PRICE_FORMAT = {'decimal_separator': ',', 'thousands_separator': '.', 'currency_symbols': ['€', 'EUR']}
+CSV_FORMAT = (';', ',', '.')
+WORDS = ['vite', 'dado', 'bullone', 'rondella', 'tassello', 'chiodo', 'staffa', 'cerniera', 'zincato', 'inox',
+         'ottone', 'testa', 'piana', 'esagonale', 'M6', 'M8', 'M10', 'x20', 'x40', 'conf.', '100pz', 'nero']
+SEARCH_TERMS = ['vite', 'inox m8', 'zzz', 'conf. 100pz']
+
+
+def _messy_price(price, rng):
+    text = f'{price:,.2f}'.replace(',', 'X').replace('.', ',').replace('X', '.')
+    return rng.choice([f'€ {text}', f' {text} ', f'{text} EUR', text.replace(',00', ''), 'n.d.'],
+                      p=[0.3, 0.3, 0.2, 0.17, 0.03])
+
+
+def generate_price_lists(folder, files, rows, overlap=0.6, max_header_offset=3, messy=0.2, seed=0):
+    """Write files synthetic workbooks of rows rows each into folder and return their mappings."""
+    import openpyxl
+    rng = np.random.default_rng(seed)
+    shared = 8000000000000 + rng.choice(rows * 10, size=rows, replace=False)
+    descriptions = [' '.join(rng.choice(WORDS, size=5)) for _ in range(rows)]
+    mappings = []
+    for n in range(files):
+        in_common = rng.random(rows) < overlap
+        items = np.where(in_common, rng.choice(shared, size=rows),
+                         8100000000000 + n * rows * 10 + np.arange(rows)).astype(object)
+        # Some suppliers use their own text codes
+        own = (~in_common) & (rng.random(rows) < 0.3)
+        items[own] = [f'{chr(65 + n % 26)}X-{i}' for i in np.flatnonzero(own)]
+        prices = np.round(rng.lognormal(2.5, 1.2, size=rows), 2).astype(object)
+        is_messy = rng.random(rows) < messy
+        prices[is_messy] = [_messy_price(p, rng) for p in prices[is_messy]]
+        header_idx = int(rng.integers(0, max_header_offset + 1))
+        fillers = n % 3
+        path = os.path.join(folder, f'listino_{n + 1:02d}.xlsx')
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet('Listino')
+        for title in range(header_idx):
+            sheet.append([f'Listino fornitore {n + 1}' if title == 0 else None])
+        sheet.append(['Codice'] + ['niente'] * fillers + ['Descrizione', 'Prezzo'])
+        picks = rng.integers(0, len(descriptions), size=rows)
+        for item, price, pick in zip(items.tolist(), prices.tolist(), picks.tolist()):
+            sheet.append([item] + [',,,,'] * fillers + [descriptions[pick], price])
+        workbook.save(path)
+        mappings.append({'file': path, 'header_idx': header_idx, 'item_col': 'Codice', 'price_col': 'Prezzo',
+                         'description_col': 'Descrizione', **PRICE_FORMAT})
+    return mappings
+
+
+class StageTimer:
+    """Wall time of named stages, with the number of rows each one handled."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name, function, rows=None):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        count = rows(result) if callable(rows) else rows
+        self.stages[name] = {'seconds': round(elapsed, 4), 'rows': count}
+        print(f'{name:<14} {elapsed:8.3f} s' + (f'  {count:,} rows' if count is not None else ''), file=sys.stderr)
+        return result
+
+
+def run_benchmark(mappings, folder, workers=0):
+    """Time every stage on the generated lists. Returns {stage: {'seconds', 'rows'}}."""
+    timer = StageTimer()
+    chunks = timer.run('read', lambda: [list(iter_price_list_chunks(m)) for m in mappings],
+                       rows=lambda result: sum(len(c) for file_chunks in result for c in file_chunks))
+    offers = timer.run('normalize', lambda: [
+        normalize_offers(pd.concat(file_chunks, ignore_index=True), 'item', 'price', 'description', m['file'],
+                         price_format(m))
+        for m, file_chunks in zip(mappings, chunks)], rows=lambda result: sum(len(o) for o in result))
+
+    def reduce_all():
+        comparison = PriceComparison()
+        for mapping, file_offers in zip(mappings, offers):
+            comparison.add_offers(mapping['file'], reduce_offers([file_offers], keep_second=False))
+        return comparison
+    comparison = timer.run('reduce', reduce_all, rows=lambda result: len(result.best))
+    timer.run('read_parallel', lambda: read_price_lists(mappings, max_workers=workers),
+              rows=lambda result: sum(len(o) for o in result if o is not None))
+    model = timer.run('results_model', lambda: ResultsModel.from_frame(comparison.results_frame()), rows=len)
+    timer.run('totals', lambda: RunningTotals.from_model(model), rows=len(model))
+    index = timer.run('search_index', lambda: ResultsSearchIndex(model), rows=len(model))
+    timer.run('search', lambda: [index.search(term) for term in SEARCH_TERMS], rows=len(SEARCH_TERMS))
+    timer.run('price_matrix', comparison.price_matrix_frame, rows=len)
+    sep, dec_sep, thou_sep = CSV_FORMAT
+    rows = model.to_frame()
+    out = os.path.join(folder, 'out')
+    os.makedirs(out, exist_ok=True)
+    timer.run('export', lambda: save_compared_csvs(out, rows, sep, dec_sep, thou_sep, only_with_quantity=False),
+              rows=len(rows))
+    temporary = os.path.join(out, 'temporary.csv')
+    timer.run('export_temp', lambda: save_temporary_csv(temporary, rows, sep, dec_sep, thou_sep), rows=len(rows))
+    timer.run('reload', lambda: ResultsModel.from_frame(load_results_csv(temporary, sep, dec_sep, thou_sep)), rows=len)
+    return timer.stages
+
+
+def compare_reports(report, baseline):
+    """Lines 'stage  old  new  ratio' for the stages in both reports."""
+    lines = []
+    for name, stage in report['stages'].items():
+        old = baseline.get('stages', {}).get(name)
+        if old is None:
+            continue
+        ratio = stage['seconds'] / old['seconds'] if old['seconds'] else float('inf')
+        lines.append(f'{name:<14} {old["seconds"]:8.3f} s -> {stage["seconds"]:8.3f} s  x{ratio:.2f}')
+    return lines
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Time the price comparison stages on synthetic price lists.')
+    parser.add_argument('--files', type=int, default=5, help='number of price lists')
+    parser.add_argument('--rows', type=int, default=20000, help='rows per price list')
+    parser.add_argument('--overlap', type=float, default=0.6, help='share of items every list has in common (0-1)')
+    parser.add_argument('--max-header-offset', type=int, default=3, help='title rows above the header, at most')
+    parser.add_argument('--messy', type=float, default=0.2, help='share of prices written as text (0-1)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-j', '--workers', type=int, default=0, help='worker processes for read_parallel (0 = one per CPU)')
+    parser.add_argument('--folder', help='keep the generated workbooks and exports here (default: a temporary folder)')
+    parser.add_argument('--report', help='write the JSON report to this file (default: stdout)')
+    parser.add_argument('--compare', help='a previous JSON report to compare the timings with')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    folder = args.folder or tempfile.mkdtemp(prefix='price_compare_bench_')
+    os.makedirs(folder, exist_ok=True)
+    try:
+        start = time.perf_counter()
+        mappings = generate_price_lists(folder, args.files, args.rows, args.overlap, args.max_header_offset,
+                                        args.messy, args.seed)
+        print(f'{"generate":<14} {time.perf_counter() - start:8.3f} s', file=sys.stderr)
+        stages = run_benchmark(mappings, folder, args.workers)
+    finally:
+        if not args.folder:
+            shutil.rmtree(folder, ignore_errors=True)
+    report = {
+        'version': REPORT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+        'params': {key: getattr(args, key) for key in ('files', 'rows', 'overlap', 'max_header_offset', 'messy', 'seed', 'workers')},
+        'stages': stages,
+    }
+    text = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('params') != report['params']:
+            print('Attenzione, i parametri del report di confronto sono diversi.', file=sys.stderr)
+        for line in compare_reports(report, baseline):
+            print(line, file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
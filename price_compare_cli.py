@@ -0,0 +1,197 @@
+"""
+Command line / batch version of the price comparison, usable without a display
+(for example from cron on the nightly supplier drop).
+
+    python price_compare_cli.py --mapping mapping.json --output out/ listini/*.xlsx
+
+The mapping spec is a JSON file:
+
+    {
+      "defaults": {"header_idx": 0, "item_col": "EAN", "price_col": "Prezzo", "description_col": "Descrizione"},
+      "profiles": {"acme": {"header_idx": 3, "item_col": "Codice", "price_col": "Netto", "description_col": "Articolo"}},
+      "files": {"acme_*.xlsx": {"profile": "acme"}, "uno.xlsx": {"price_col": "price"}}
+    }
+
+"files" keys are matched against the file name (shell-style wildcards allowed),
+the first match wins; missing keys are taken from the profile, then from
+"defaults", then from the --header-idx/--item-col/... options. Entries may also
+set decimal_separator, thousands_separator and currency_symbols for reading
+text prices (default: the values in config.json).
+
+With --auto, files without a "files" entry that the defaults do not fully map
+get their header row and columns from the profiles saved by the GUI
+(mapping_profiles_file in config.json) or, failing that, from detection on
+their first rows. An entry that cannot be resolved (e.g. an unknown profile)
+is still an error.
+"""
+import argparse
+import fnmatch
+import glob
+import json
+import os
+import sys
+
+from price_compare_engine import READERS, DEFAULT_READER, PRICE_FORMAT_KEYS, PriceComparison, describe_unparsed
+from price_compare_export import MATRIX_CSV_NAME, save_compared_csvs, save_price_matrix_csv
+from price_list_cache import PriceListCache
+from mapping_profiles import MappingProfiles
+from description_matching import MatchDecisions
+from price_history import PriceHistory, DEFAULT_HISTORY_FILE
+from results_model import ResultsModel
+
+MAPPING_KEYS = ('header_idx', 'item_col', 'price_col', 'description_col')
+
+
+def load_config(path):
+    config = {'csv_separator': ',', 'decimal_separator': '.', 'thousands_separator': ','}
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            config.update(json.load(f))
+    return config
+
+
+def load_mapping_spec(path):
+    if not path:
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def spec_entry(file, spec):
+    """The first "files" entry of the spec matching file, or None."""
+    name = os.path.basename(file)
+    for pattern, file_entry in spec.get('files', {}).items():
+        if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(file, pattern):
+            return file_entry
+    return None
+
+
+def resolve_mapping(file, spec, defaults):
+    """Build the column mapping for file from the spec, or raise ValueError."""
+    name = os.path.basename(file)
+    entry = spec_entry(file, spec) or {}
+    profile = {}
+    if 'profile' in entry:
+        profile = spec.get('profiles', {}).get(entry['profile'])
+        if profile is None:
+            raise ValueError(f'{name}: unknown profile {entry["profile"]!r}')
+    mapping = {'file': file}
+    for key in MAPPING_KEYS:
+        for source in (entry, profile, spec.get('defaults', {}), defaults):
+            if source.get(key) is not None:
+                mapping[key] = source[key]
+                break
+        else:
+            raise ValueError(f'{name}: no {key} in the mapping spec')
+    for key in PRICE_FORMAT_KEYS:
+        for source in (entry, profile, spec.get('defaults', {}), defaults):
+            if source.get(key) is not None:
+                mapping[key] = source[key]
+                break
+    mapping['header_idx'] = int(mapping['header_idx'])
+    return mapping
+
+
+def expand_files(patterns, spec):
+    # Expand wildcards ourselves too, the Windows shell does not
+    files = []
+    for pattern in patterns or [p for p in spec.get('files', {}) if os.path.exists(p)]:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for file in matches:
+            if file not in files:
+                files.append(file)
+    return files
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Compare supplier price lists without the GUI.')
+    parser.add_argument('files', nargs='*', help='Excel (.xlsx/.xls) or PDF price lists, wildcards allowed')
+    parser.add_argument('-m', '--mapping', help='JSON mapping spec (header row and columns per file/profile)')
+    parser.add_argument('-o', '--output', default='.', help='folder for result_compared.csv and the *_compared.csv files')
+    parser.add_argument('-c', '--config', default='config.json', help='config.json with the CSV separators')
+    parser.add_argument('--header-idx', type=int, help='default header row (0 = first row)')
+    parser.add_argument('--item-col', help='default item/EAN column')
+    parser.add_argument('--price-col', help='default price column')
+    parser.add_argument('--description-col', help='default description column')
+    parser.add_argument('--history', action='store_true',
+                        help='store new or changed lists in the price history (price_history_file in the config)')
+    parser.add_argument('--auto', action='store_true',
+                        help='detect header row and columns of the files without a spec entry (saved GUI profiles first)')
+    parser.add_argument('-j', '--workers', type=int, help='worker processes (default: max_workers from the config, 0 = one per CPU)')
+    parser.add_argument('--reader', choices=READERS, help='Excel reader (default: excel_reader from the config)')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the parsed price-list cache')
+    parser.add_argument('--only-with-quantity', action='store_true',
+                        help='like the GUI export, write only rows with a quantity (batch results have none by default)')
+    parser.add_argument('--matrix', action='store_true',
+                        help=f'also write {MATRIX_CSV_NAME}: the price of every list per item, best/second price, spread and supplier count')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = load_config(args.config)
+    spec = load_mapping_spec(args.mapping)
+    defaults = {'header_idx': args.header_idx, 'item_col': args.item_col,
+                'price_col': args.price_col, 'description_col': args.description_col,
+                **{key: config.get(key) for key in PRICE_FORMAT_KEYS}}
+    files = expand_files(args.files, spec)
+    if not files:
+        print('No price lists to compare.', file=sys.stderr)
+        return 2
+    failed = []
+    mappings = []
+    profiles = MappingProfiles.from_config(config).profiles if args.auto else None
+    for file in files:
+        try:
+            mappings.append(resolve_mapping(file, spec, defaults))
+        except ValueError as e:
+            if args.auto and spec_entry(file, spec) is None:
+                # Resolved by the reader on the rows it streams anyway
+                mappings.append({'file': file, 'header_idx': None, 'profiles': profiles,
+                                 **{key: defaults[key] for key in PRICE_FORMAT_KEYS}})
+                continue
+            print(e, file=sys.stderr)
+            failed.append(file)
+
+    def on_error(file, e):
+        print(f'Impossibile processare {file}: {e}', file=sys.stderr)
+        failed.append(file)
+    cache = None if args.no_cache else PriceListCache.from_config(config)
+    comparison = PriceComparison(cache=cache, reader=args.reader or config.get('excel_reader', DEFAULT_READER))
+    # Description matches confirmed in the GUI merge the items here too
+    comparison.set_item_aliases(MatchDecisions.from_config(config).aliases())
+    workers = args.workers if args.workers is not None else config.get('max_workers', 0)
+    comparison.add_price_lists(mappings, max_workers=workers, on_error=on_error)
+    if args.history:
+        # Query it with price_history.py (item / changes / best)
+        history = PriceHistory(config.get('price_history_file') or DEFAULT_HISTORY_FILE)
+        imported = history.ingest_comparison(comparison, mappings, on_error=on_error)
+        print(f'{imported} listini nuovi o modificati nello storico {history.path}')
+    for file, summary in comparison.unparsed_prices().items():
+        print(f'Attenzione, {describe_unparsed(file, summary)}', file=sys.stderr)
+    rows = ResultsModel.from_frame(comparison.results_frame()).to_frame()
+    os.makedirs(args.output, exist_ok=True)
+
+    def on_write_error(path, e):
+        print(f'Failed to save {path}: {e}', file=sys.stderr)
+        failed.append(path)
+    written = save_compared_csvs(
+        args.output, rows,
+        config.get('csv_separator', ','), config.get('decimal_separator', '.'), config.get('thousands_separator', ','),
+        only_with_quantity=args.only_with_quantity, on_error=on_write_error
+    )
+    if args.matrix:
+        matrix_path = os.path.join(args.output, MATRIX_CSV_NAME)
+        try:
+            save_price_matrix_csv(matrix_path, comparison.price_matrix_frame(), config.get('csv_separator', ','),
+                                  config.get('decimal_separator', '.'), config.get('thousands_separator', ','))
+            written.append(matrix_path)
+        except Exception as e:
+            on_write_error(matrix_path, e)
+    print(f'{len(comparison)} listini ({comparison.memory_usage() / 1e6:.1f} MB in memoria), '
+          f'{len(rows)} articoli, {len(written)} file CSV in {args.output}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,849 @@
+import os
+import re
+import time
+from itertools import chain, islice
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from mapping_profiles import DETECT_ROWS, auto_mapping
+from stage_metrics import measure
+
+# Comparison engine used by PriceCompareApp. It must not import tkinter so it
+# can be reused outside the GUI.
+
+# item_key and file are categoricals, price is a float (NaN when unreadable)
+OFFER_COLUMNS = ['item_key', 'original_item', 'description', 'price', 'file']
+# Best price of the other lists for the same item (inf when there is none)
+VALUE_COLUMNS = ['second_value']
+# 'streaming' reads only the mapped columns row by row in read-only mode,
+# 'pandas' uses pd.read_excel on the whole sheet.
+READERS = ('streaming', 'pandas')
+DEFAULT_READER = 'streaming'
+READ_CHUNK_ROWS = 50000
+PROGRESS_ROWS = 5000
+# How text prices are read; a mapping may carry its own values for these keys
+PRICE_FORMAT_KEYS = ('decimal_separator', 'thousands_separator', 'currency_symbols')
+DEFAULT_PRICE_FORMAT = {'decimal_separator': '.', 'thousands_separator': ',', 'currency_symbols': ['€', '$', '£', 'EUR', 'USD']}
+UNPARSED_EXAMPLES = 5
+
+
+def normalize_item_column(items):
+    """
+    Vectorized version of the per-row item normalization.
+    Numeric cells become ints (so 123, 123.0 and '123' match), everything else
+    is kept as text and matched case-insensitively after stripping.
+    Returns (item_key, original_item): item_key as a categorical,
+    original_item as an object Series.
+    """
+    items = pd.Series(items).reset_index(drop=True)
+    missing = items.isna().to_numpy()
+    numeric = pd.to_numeric(items.astype(object), errors='coerce').to_numpy(dtype=float)
+    is_num = ~missing & np.isfinite(numeric)
+    is_text = ~missing & ~is_num
+    original_item = np.full(len(items), '', dtype=object)
+    item_key = np.full(len(items), '', dtype=object)
+    # Codes from 2**63 on (20+ digits) do not fit in int64: Python ints, int(float(x)) like before
+    big = is_num & (np.abs(numeric) >= 2.0 ** 63)
+    is_num &= ~big
+    if is_num.any():
+        ints = np.trunc(numeric[is_num]).astype(np.int64)
+        original_item[is_num] = ints.tolist()
+        item_key[is_num] = ints.astype(str)
+    if big.any():
+        ints = [int(value) for value in numeric[big].tolist()]
+        original_item[big] = ints
+        item_key[big] = [str(value) for value in ints]
+    if is_text.any():
+        text = items[is_text].map(str)
+        original_item[is_text] = text.to_numpy(dtype=object)
+        item_key[is_text] = text.str.strip().str.lower().to_numpy(dtype=object)
+    codes, keys = pd.factorize(item_key, sort=False)
+    return pd.Series(pd.Categorical.from_codes(codes, keys)), pd.Series(original_item, dtype=object)
+
+
+def _share_repeated_text(values):
+    # Equal texts (descriptions repeat a lot) point to a single string object
+    values = values.copy()
+    is_text = np.array([type(v) is str for v in values], dtype=bool)
+    codes, texts = pd.factorize(values[is_text], sort=False)
+    values[is_text] = np.asarray(texts, dtype=object)[codes]
+    return pd.Series(values, dtype=object)
+
+
+def file_column(file, length):
+    return pd.Categorical.from_codes(np.zeros(length, dtype=np.int8), [file])
+
+
+def sort_values(offers):
+    """The value the reduction minimizes: the price, inf when it is unreadable."""
+    return np.nan_to_num(offers['price'].to_numpy(dtype=float), nan=np.inf)
+
+
+def price_format(mapping):
+    """The price format of a mapping, DEFAULT_PRICE_FORMAT for the keys it does not set."""
+    return {key: mapping[key] if mapping.get(key) is not None else DEFAULT_PRICE_FORMAT[key] for key in PRICE_FORMAT_KEYS}
+
+
+def normalize_price_column(prices, decimal_separator='.', thousands_separator=',', currency_symbols=()):
+    """
+    Convert a price column to floats. Numeric cells are taken as they are;
+    text cells lose currency symbols and spaces and are read with the given
+    separators ('€ 1.234,50' with ',' as decimal separator). A text with a
+    single other separator not followed by three digits is read as a decimal
+    too, so both '12,3' and '12.3' work.
+    Returns (price, unparsed): blank or unreadable cells are NaN and flagged.
+    """
+    prices = pd.Series(prices).reset_index(drop=True)
+    if pd.api.types.is_numeric_dtype(prices.dtype) and not pd.api.types.is_bool_dtype(prices.dtype):
+        price = prices.to_numpy(dtype=float, na_value=np.nan)
+        return price, np.isnan(price)
+    values = prices.to_numpy(dtype=object)
+    is_text = np.array([isinstance(v, str) for v in values], dtype=bool)
+    price = np.full(len(values), np.nan)
+    if (~is_text).any():
+        price[~is_text] = pd.to_numeric(pd.Series(values[~is_text], dtype=object), errors='coerce').to_numpy(dtype=float)
+    if is_text.any():
+        price[is_text] = _parse_price_text(values[is_text], decimal_separator, thousands_separator, currency_symbols)
+    return price, np.isnan(price)
+
+
+def _parse_price_text(texts, decimal_separator, thousands_separator, currency_symbols):
+    # Price lists repeat the same prices a lot: parse each distinct text once
+    codes, uniques = pd.factorize(pd.Series(texts, dtype=object), sort=False)
+    text = pd.Series(np.asarray(uniques, dtype=object), dtype=object)
+    if currency_symbols:
+        symbols = '|'.join(re.escape(symbol) for symbol in sorted(currency_symbols, key=len, reverse=True))
+        text = text.str.replace(symbols, '', regex=True, flags=re.IGNORECASE)
+    text = text.str.replace(r'\s+', '', regex=True)
+    dec, thou = re.escape(decimal_separator), re.escape(thousands_separator or '')
+    numbers = pd.Series(np.full(len(text), 'nan', dtype=object))
+    todo = np.ones(len(text), dtype=bool)
+    forms = []
+    if thousands_separator:
+        # 1.234.567,89: thousands groups, then the decimals
+        forms.append((rf'[+-]?\d{{1,3}}(?:{thou}\d{{3}})+(?:{dec}\d*)?', [(thousands_separator, ''), (decimal_separator, '.')]))
+    forms.append((rf'[+-]?(?:\d+(?:{dec}\d*)?|{dec}\d+)', [(decimal_separator, '.')]))
+    if thousands_separator:
+        # 12.3 with ',' as decimal separator: not a thousands group, so a decimal
+        forms.append((rf'[+-]?\d*{thou}\d+', [(thousands_separator, '.')]))
+    for pattern, replacements in forms:
+        match = todo & text.str.fullmatch(pattern).fillna(False).to_numpy(dtype=bool)
+        converted = text[match]
+        for old, new in replacements:
+            converted = converted.str.replace(old, new, regex=False)
+        numbers[match] = converted
+        todo &= ~match
+    # numpy converts like float(), without the rounding of the fast pandas parser
+    return np.array(numbers.tolist(), dtype=str).astype(float)[codes]
+
+
+def normalize_offers(df, item_col, price_col, description_col, file, price_format=None):
+    """
+    Build the offers frame (OFFER_COLUMNS plus VALUE_COLUMNS) for one price list.
+    Offers without a readable price sort last; the rows with an item but no
+    readable price are summarized in attrs['unparsed_prices'] (see merge_unparsed).
+    """
+    item_key, original_item = normalize_item_column(df[item_col])
+    price, unparsed = normalize_price_column(df[price_col], **(price_format or DEFAULT_PRICE_FORMAT))
+    description = df[description_col].reset_index(drop=True).astype(object)
+    description[description.isna()] = np.nan
+    offers = pd.DataFrame({
+        'item_key': item_key,
+        'original_item': original_item,
+        'description': _share_repeated_text(description.to_numpy(dtype=object)),
+        'price': price,
+        'file': file_column(file, len(item_key)),
+        'second_value': np.inf,
+    })
+    flagged = np.flatnonzero(unparsed & (item_key != '').to_numpy())
+    raw_prices = df[price_col].reset_index(drop=True)
+    offers.attrs['unparsed_prices'] = {
+        'count': len(flagged),
+        'examples': [(original_item[i], '' if pd.isna(raw_prices[i]) else str(raw_prices[i])) for i in flagged[:UNPARSED_EXAMPLES]],
+    }
+    return offers
+
+
+def merge_unparsed(summaries):
+    """
+    Merge attrs['unparsed_prices'] summaries ({'count': rows, 'examples':
+    [(item, price cell), ...]}); None entries are skipped.
+    """
+    summary = {'count': 0, 'examples': []}
+    for part in summaries:
+        if part:
+            summary['count'] += part['count']
+            summary['examples'] = (summary['examples'] + part['examples'])[:UNPARSED_EXAMPLES]
+    return summary
+
+
+def describe_unparsed(file, summary):
+    """One line about the rows of file left out of the comparison for their price."""
+    examples = ', '.join(f'{item}: {price!r}' for item, price in summary['examples'])
+    return f"{os.path.basename(file)}: {summary['count']} righe senza un prezzo valido (es. {examples})"
+
+
+class ComparisonCancelled(Exception):
+    """Raised when a comparison is cancelled through its cancel event."""
+
+
+class MappingNotDetected(ValueError):
+    """Raised when a mapping to detect (header_idx None) matches no profile and no confident guess."""
+
+
+def _iter_xlsx_rows(workbook):
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield row
+    finally:
+        workbook.close()
+
+
+def _iter_xls_rows(workbook):
+    try:
+        sheet = workbook.sheet_by_index(0)
+        for r in range(sheet.nrows):
+            row = []
+            for value in sheet.row_values(r):
+                if value == '':
+                    value = None
+                elif isinstance(value, float) and value.is_integer():
+                    value = int(value)
+                row.append(value)
+            yield tuple(row)
+    finally:
+        workbook.release_resources()
+
+
+def is_pdf(file):
+    return file.lower().endswith('.pdf')
+
+
+def _open_sheet_rows(file, cache=None, max_workers=None, cancel=None):
+    """
+    Return (row_count, rows) for the first sheet; row_count is 0 if unknown.
+    For a PDF the rows are those of its tables, stacked in page order.
+    """
+    if is_pdf(file):
+        from pdf_extract import pdf_rows
+        return pdf_rows(file, cache, max_workers, cancel)
+    if file.lower().endswith('.xls'):
+        import xlrd
+        workbook = xlrd.open_workbook(file, on_demand=True)
+        return workbook.sheet_by_index(0).nrows, _iter_xls_rows(workbook)
+    import openpyxl
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    return workbook.worksheets[0].max_row or 0, _iter_xlsx_rows(workbook)
+
+
+def open_sheet_head(file, nrows):
+    """
+    (row_count, head, rows) of an Excel file: its first nrows rows and the
+    still open rows after them. Passed to iter_price_list_chunks as opened,
+    the full read goes on from the same parse instead of loading the
+    workbook again; close rows if it is not used.
+    """
+    row_count, rows = _open_sheet_rows(file)
+    try:
+        head = list(islice(rows, nrows))
+    except Exception:
+        rows.close()
+        raise
+    return row_count, head, rows
+
+
+def preview_frame(head):
+    """Rows as the mapping dialog shows them: a frame without a header, blank cells NaN."""
+    width = max((len(row) for row in head), default=0)
+    return pd.DataFrame([[np.nan if value is None else value for value in row] + [np.nan] * (width - len(row))
+                         for row in head], dtype=object)
+
+
+def read_preview(file, nrows, cache=None):
+    """
+    The first nrows rows of the sheet (or of the PDF tables), without a header,
+    for the mapping dialog. Excel rows come from the same streaming reader as
+    the full read, which stops after nrows, so the labels shown are the ones
+    the read will look for; blank cells are NaN.
+    """
+    if is_pdf(file):
+        from pdf_extract import pdf_preview
+        return pdf_preview(file, nrows, cache)
+    _, head, rows = open_sheet_head(file, nrows)
+    rows.close()
+    return preview_frame(head)
+
+
+def _find_column(header, name):
+    # The mapping dialog shows header cells through str(), with blanks as 'nan'
+    labels = ['nan' if value is None else str(value) for value in header]
+    if name not in labels:
+        raise ValueError(f'Column {name!r} not found in the header row')
+    return labels.index(name)
+
+
+def resolve_auto_mapping(mapping, rows):
+    """
+    header_idx and the columns for a mapping without them: the saved profile
+    in mapping['profiles'] matching the rows, else the detected mapping if
+    confident enough, else MappingNotDetected.
+    """
+    resolved = auto_mapping(rows, mapping.get('profiles'))
+    if resolved is None:
+        raise MappingNotDetected('Intestazione e colonne non riconosciute, indicarle a mano')
+    return {key: resolved[key] for key in ('header_idx', 'item_col', 'price_col', 'description_col')}
+
+
+def iter_price_list_chunks(mapping, chunk_size=READ_CHUNK_ROWS, progress=None, cancel=None, cache=None, max_workers=None,
+                           opened=None):
+    """
+    Stream the first sheet of a mapped .xlsx/.xls file (or the tables of a
+    PDF) and yield DataFrames of at most chunk_size rows with only the 'item',
+    'price' and 'description' columns. Rows where all three cells are empty
+    are skipped, and so are the header rows a PDF repeats on every page.
+    progress(rows_read, row_count) is called every PROGRESS_ROWS rows, and
+    ComparisonCancelled is raised as soon as cancel.is_set() is true.
+    cache and max_workers are used for the pages of a PDF.
+    A mapping with header_idx None is resolved on its first DETECT_ROWS rows
+    (see resolve_auto_mapping), which are then read on from the same parse.
+    opened is the (row_count, head, rows) of open_sheet_head for the file,
+    read instead of opening it again.
+    """
+    if opened is None:
+        row_count, rows = _open_sheet_rows(mapping['file'], cache, max_workers, cancel)
+        sheet = rows
+    else:
+        row_count, first_rows, rows = opened
+        sheet = chain(first_rows, rows)
+    repeated_header = is_pdf(mapping['file'])
+    try:
+        body = sheet
+        if mapping.get('header_idx') is None:
+            head = list(islice(sheet, DETECT_ROWS))
+            mapping = {**mapping, **resolve_auto_mapping(mapping, head)}
+            header = head[mapping['header_idx']]
+            body = chain(head[mapping['header_idx'] + 1:], sheet)
+        else:
+            header = None
+            for idx, row in enumerate(sheet):
+                if idx == mapping['header_idx']:
+                    header = row
+                    break
+            if header is None:
+                raise ValueError(f'Header row {mapping["header_idx"] + 1} not found')
+        indices = [_find_column(header, mapping[key]) for key in ('item_col', 'price_col', 'description_col')]
+        chunk = []
+        rows_read = mapping['header_idx'] + 1
+        for row in body:
+            rows_read += 1
+            if rows_read % PROGRESS_ROWS == 0:
+                if cancel is not None and cancel.is_set():
+                    raise ComparisonCancelled()
+                if progress is not None:
+                    progress(rows_read, row_count)
+            values = [row[i] if i < len(row) else None for i in indices]
+            if values[0] is None and values[1] is None and values[2] is None:
+                continue
+            if repeated_header and all(value == header[i] for value, i in zip(values, indices)):
+                continue
+            chunk.append(values)
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame(chunk, columns=['item', 'price', 'description'])
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=['item', 'price', 'description'])
+        if progress is not None:
+            progress(rows_read, max(row_count, rows_read))
+    finally:
+        rows.close()
+
+
+def read_price_list(mapping, cache=None, reader=DEFAULT_READER, progress=None, cancel=None, max_workers=None, opened=None):
+    """
+    Read one mapped Excel or PDF file and return its offers, already reduced
+    to the cheapest offer per item within the file.
+    If a PriceListCache is given, unchanged files are loaded from it instead.
+    progress and cancel are passed to iter_price_list_chunks (the 'pandas'
+    reader only reports progress once the whole sheet is read). PDFs and
+    mappings to detect (header_idx None) are always streamed, PDF pages
+    extracted by max_workers processes, and so is a file already opened by
+    open_sheet_head (opened).
+    The time spent normalizing codes and prices, and the rows normalized, are
+    left in attrs['normalize_seconds'] and attrs['normalize_rows'].
+    """
+    if cache is not None:
+        offers = cache.load_offers(mapping)
+        if offers is not None:
+            return offers
+    if reader == 'streaming' or is_pdf(mapping['file']) or mapping.get('header_idx') is None or opened is not None:
+        # Reduce chunk by chunk so memory depends on distinct items, not on rows
+        offers = reduce_offers([])
+        unparsed = []
+        normalize_seconds = normalize_rows = 0
+        for chunk in iter_price_list_chunks(mapping, progress=progress, cancel=cancel, cache=cache, max_workers=max_workers,
+                                            opened=opened):
+            start = time.perf_counter()
+            chunk_offers = normalize_offers(chunk, 'item', 'price', 'description', mapping['file'], price_format(mapping))
+            normalize_seconds += time.perf_counter() - start
+            normalize_rows += len(chunk)
+            unparsed.append(chunk_offers.attrs['unparsed_prices'])
+            offers = reduce_offers([offers, chunk_offers], keep_second=False)
+        offers.attrs['unparsed_prices'] = merge_unparsed(unparsed)
+    else:
+        df = pd.read_excel(
+            mapping['file'],
+            usecols=[mapping['item_col'], mapping['price_col'], mapping['description_col']],
+            header=mapping['header_idx']
+        )
+        if cancel is not None and cancel.is_set():
+            raise ComparisonCancelled()
+        if progress is not None:
+            progress(len(df), len(df))
+        start = time.perf_counter()
+        offers = normalize_offers(df, mapping['item_col'], mapping['price_col'], mapping['description_col'], mapping['file'],
+                                  price_format(mapping))
+        normalize_seconds, normalize_rows = time.perf_counter() - start, len(df)
+        unparsed = offers.attrs['unparsed_prices']
+        offers = reduce_offers([offers], keep_second=False)
+        offers.attrs['unparsed_prices'] = unparsed
+    if cache is not None:
+        cache.store_offers(mapping, offers)
+    offers.attrs['normalize_seconds'] = normalize_seconds
+    offers.attrs['normalize_rows'] = normalize_rows
+    return offers
+
+
+def _read_price_list_in_worker(index, mapping, reader, queue, cancel):
+    # Runs in a pool process: progress goes back to the parent through a queue
+    def progress(rows_read, row_count):
+        queue.put((index, rows_read, row_count))
+    return read_price_list(mapping, None, reader, progress, cancel)
+
+
+def resolve_worker_count(max_workers, jobs):
+    """Number of worker processes to use: max_workers <= 0 or None means one per CPU."""
+    if not max_workers or max_workers <= 0:
+        max_workers = os.cpu_count() or 1
+    return max(1, min(int(max_workers), jobs))
+
+
+def read_price_lists(mappings, max_workers=None, cache=None, on_error=None, reader=DEFAULT_READER,
+                     progress=None, cancel=None, opened=None):
+    """
+    Read several mapped Excel files, parsing them in parallel worker processes.
+    Returns one offers frame per mapping, in the same order (None for files that
+    failed; on_error(file, exception) is called for each of them). Cached files
+    are loaded in this process and only the others are sent to the pool. PDFs
+    are read in this process too, one at a time, their pages spread over the
+    worker processes instead. opened maps files to their open_sheet_head
+    result; those files are read in this process from it (and removed from
+    the dict, the caller closes what is left).
+    progress(files_done, files_total, rows_read, row_count) reports overall
+    progress; if cancel.is_set() becomes true, ComparisonCancelled is raised.
+    """
+    frames = [None] * len(mappings)
+    rows = {}  # mapping index -> (rows_read, row_count)
+    state = {'files_done': 0}
+
+    def report():
+        if progress is not None:
+            progress(state['files_done'], len(mappings),
+                     sum(r for r, _ in rows.values()), sum(c for _, c in rows.values()))
+
+    def file_done(i, offers):
+        frames[i] = offers
+        state['files_done'] += 1
+        if offers is not None:
+            read, count = rows.get(i, (0, 0))
+            rows[i] = (max(read, count), max(read, count))
+        report()
+
+    def read_here(indices, page_workers):
+        for i in indices:
+            if cancel is not None and cancel.is_set():
+                raise ComparisonCancelled()
+
+            def file_progress(rows_read, row_count, i=i):
+                rows[i] = (rows_read, row_count)
+                report()
+            try:
+                offers = read_price_list(mappings[i], cache, reader, file_progress, cancel, page_workers,
+                                         opened.pop(mappings[i]['file'], None))
+            except ComparisonCancelled:
+                raise
+            except Exception as e:
+                offers = None
+                if on_error is not None:
+                    on_error(mappings[i]['file'], e)
+            file_done(i, offers)
+
+    if opened is None:
+        opened = {}
+    pending = []
+    pdfs = []
+    here = []
+    for i, mapping in enumerate(mappings):
+        offers = cache.load_offers(mapping) if cache is not None else None
+        if offers is not None:
+            file_done(i, offers)
+        elif is_pdf(mapping['file']):
+            pdfs.append(i)
+        elif mapping['file'] in opened:
+            # Its open rows cannot be sent to a pool process
+            here.append(i)
+        else:
+            pending.append(i)
+    read_here(pdfs, max_workers)
+    read_here(here, 1)
+    workers = resolve_worker_count(max_workers, len(pending))
+    if workers <= 1:
+        read_here(pending, 1)
+        return frames
+    if progress is None and cancel is None:
+        queue = worker_cancel = manager = None
+    else:
+        import multiprocessing
+        manager = multiprocessing.Manager()
+        queue = manager.Queue()
+        worker_cancel = manager.Event()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            if manager is None:
+                futures = {executor.submit(read_price_list, mappings[i], None, reader): i for i in pending}
+            else:
+                futures = {executor.submit(_read_price_list_in_worker, i, mappings[i], reader, queue, worker_cancel): i
+                           for i in pending}
+            not_done = set(futures)
+            while not_done:
+                done, not_done = wait(not_done, timeout=0.2, return_when=FIRST_COMPLETED)
+                while queue is not None and not queue.empty():
+                    i, rows_read, row_count = queue.get()
+                    rows[i] = (rows_read, row_count)
+                if cancel is not None and cancel.is_set():
+                    worker_cancel.set()
+                    for future in not_done:
+                        future.cancel()
+                    raise ComparisonCancelled()
+                for future in done:
+                    i = futures[future]
+                    try:
+                        offers = future.result()
+                    except Exception as e:
+                        offers = None
+                        if on_error is not None:
+                            on_error(mappings[i]['file'], e)
+                    if offers is not None and cache is not None:
+                        cache.store_offers(mappings[i], offers)
+                    file_done(i, offers)
+                if not done:
+                    report()
+    finally:
+        if manager is not None:
+            manager.shutdown()
+    return frames
+
+
+def apply_item_aliases(offers, aliases):
+    """offers with their item_key mapped through aliases ({item_key: group key}), e.g. confirmed description matches."""
+    if not aliases or offers is None or not len(offers):
+        return offers
+    categories = offers['item_key'].cat.categories
+    renamed = [aliases.get(key, key) for key in categories]
+    if renamed == list(categories):
+        return offers
+    codes, keys = pd.factorize(pd.Index(renamed, dtype=categories.dtype), sort=False)
+    offers = offers.copy(deep=False)
+    offers['item_key'] = pd.Categorical.from_codes(codes[offers['item_key'].cat.codes.to_numpy()], keys)
+    return offers
+
+
+def reduce_offers(offers_frames, keep_second=True):
+    """
+    Reduce offers to the cheapest one per item_key, in first-seen item order.
+    On ties the first offer (in file order, then row order) wins. Frames may be
+    previous reductions, which is what makes incremental merging possible.
+    With keep_second, 'second_value' becomes the lowest price among the offers
+    that did not win (within one file pass keep_second=False: duplicates of the
+    same list are not a second offer).
+    """
+    frames = [f for f in offers_frames if f is not None and len(f)]
+    if not frames:
+        return pd.DataFrame(columns=OFFER_COLUMNS + VALUE_COLUMNS)
+    return _reduce(frames, keep_second)[0]
+
+
+def _reduce(frames, keep_second):
+    # reduce_offers on non-empty frames; also returns, for every row of the
+    # concatenated frames, the row of its item in the result
+    offers = pd.concat([f.drop(columns=['item_key', 'file']) for f in frames], ignore_index=True)
+    # Merge the categories of every frame and group on the integer codes
+    item_key = union_categoricals([f['item_key'] for f in frames])
+    offers['item_key'] = item_key
+    offers['file'] = union_categoricals([f['file'] for f in frames])
+    codes = item_key.codes
+    values = sort_values(offers)
+    best_idx = pd.Series(values).groupby(codes, sort=False).idxmin().to_numpy()
+    best = offers.loc[best_idx, OFFER_COLUMNS + VALUE_COLUMNS].reset_index(drop=True)
+    best['item_key'] = best['item_key'].cat.remove_unused_categories()
+    best['file'] = best['file'].cat.remove_unused_categories()
+    positions = np.empty(len(item_key.categories), dtype=np.intp)
+    positions[codes[best_idx]] = np.arange(len(best_idx))
+    positions = positions[codes]
+    if not keep_second:
+        best['second_value'] = np.inf
+        return best, positions
+    # Per item: the lowest second_value of any offer and the lowest price of the offers that did not win
+    losers = np.ones(len(offers), dtype=bool)
+    losers[best_idx] = False
+    second = np.full(len(item_key.categories), np.inf)
+    np.minimum.at(second, codes, offers['second_value'].to_numpy(dtype=float))
+    np.minimum.at(second, codes[losers], values[losers])
+    best['second_value'] = second[codes[best_idx]]
+    return best, positions
+
+
+class SupplierPrices:
+    """
+    The price of every list for each row of a best-offers frame:
+    prices[row, column] is the lowest readable price of files[column] for
+    that item, NaN when the list does not have it.
+    """
+
+    def __init__(self, files=(), prices=None):
+        self.files = list(files)
+        self.prices = np.empty((0, len(self.files))) if prices is None else prices
+
+    def __len__(self):
+        return len(self.prices)
+
+    def summary(self):
+        """Per row: best and second best price, spread (highest - lowest) and number of suppliers."""
+        suppliers = np.count_nonzero(~np.isnan(self.prices), axis=1)
+        ordered = np.sort(self.prices, axis=1)  # NaN last
+        nan = np.full(len(self), np.nan)
+        best = ordered[:, 0] if len(self.files) else nan
+        second = ordered[:, 1] if len(self.files) > 1 else nan
+        highest = ordered[np.arange(len(self)), np.maximum(suppliers - 1, 0)] if len(self.files) else nan
+        # Rounded so that 77.7 - 2.1 is written as 75.6
+        spread = np.round(highest - best, 6)
+        return {'best_price': best, 'second_price': second, 'spread': spread, 'suppliers': suppliers}
+
+
+def reduce_offers_with_prices(offers_frames, supplier_prices=None, keep_second=True):
+    """
+    reduce_offers, plus the SupplierPrices of the result computed in the same
+    pass. supplier_prices[i] belongs to offers_frames[i] when that frame is a
+    previous reduction; None means the prices are read from the frame's rows.
+    Returns (best, SupplierPrices).
+    """
+    if supplier_prices is None:
+        supplier_prices = [None] * len(offers_frames)
+    kept = [(f, p) for f, p in zip(offers_frames, supplier_prices) if f is not None and len(f)]
+    if not kept:
+        return reduce_offers([]), SupplierPrices()
+    frames = [f for f, _ in kept]
+    best, positions = _reduce(frames, keep_second)
+    files = []
+    for frame, prices in kept:
+        for file in (prices.files if prices is not None else frame['file'].cat.categories):
+            if file not in files:
+                files.append(file)
+    column_of = {file: i for i, file in enumerate(files)}
+    matrix = np.full((len(best), len(files)), np.nan)
+    start = 0
+    for frame, prices in kept:
+        rows = positions[start:start + len(frame)]
+        start += len(frame)
+        if prices is None:
+            columns = np.array([column_of[f] for f in frame['file'].cat.categories], dtype=np.intp)[frame['file'].cat.codes.to_numpy()]
+            np.fmin.at(matrix, (rows, columns), frame['price'].to_numpy(dtype=float))
+        else:
+            # A previous reduction has one row per item
+            columns = [column_of[f] for f in prices.files]
+            matrix[np.ix_(rows, columns)] = np.fmin(matrix[np.ix_(rows, columns)], prices.prices)
+    return best, SupplierPrices(files, matrix)
+
+
+def best_offers_order(best):
+    """Row order of sort_best_offers: by description (case-insensitive), first-seen order on ties."""
+    # Rank the distinct descriptions instead of comparing a string per row
+    codes, descriptions = pd.factorize(best['description'].map(str), sort=False)
+    ranks, _ = pd.factorize(pd.Series(descriptions, dtype=object).str.lower(), sort=True)
+    return np.argsort(ranks[codes], kind='stable')
+
+
+def sort_best_offers(best):
+    """Sort reduced offers by description (case-insensitive), keeping first-seen order on ties."""
+    return best.iloc[best_offers_order(best)][OFFER_COLUMNS + ['second_value']].reset_index(drop=True)
+
+
+def find_best_offers(offers_frames):
+    """Cheapest offer per item across all frames, sorted for display."""
+    return sort_best_offers(reduce_offers(offers_frames))
+
+
+def results_frame_from_offers(best):
+    """
+    Columns item, price, description, file and second_price of the best offers.
+    'second_price' is the best price of the other lists, NaN if there is none.
+    """
+    if best is None or best.empty:
+        return pd.DataFrame(columns=['item', 'price', 'description', 'file', 'second_price'])
+    results = best.rename(columns={'original_item': 'item'})[['item', 'price', 'description', 'file']]
+    second = best['second_value'].to_numpy(dtype=float)
+    return results.assign(second_price=np.where(np.isfinite(second), second, np.nan))
+
+
+def results_from_offers(best):
+    """Convert the best-offers frame to a list of dicts (see results_frame_from_offers)."""
+    if best is None or best.empty:
+        return []
+    return results_frame_from_offers(best).to_dict('records')
+
+
+def compare_price_lists(mappings, on_error=None, cache=None, max_workers=None, reader=DEFAULT_READER):
+    """
+    Read every mapped price list and return the lowest-price results.
+    on_error(file, exception) is called for files that cannot be processed;
+    they are skipped and the comparison continues with the others.
+    """
+    frames = read_price_lists(mappings, max_workers, cache, on_error, reader)
+    return results_from_offers(find_best_offers(frames))
+
+
+class PriceComparison:
+    """
+    Keeps the normalized offers of every loaded price list and the current best
+    offer per item in memory. Adding a list only merges its offers into the
+    current best; removing one recomputes from the lists already in memory.
+    The price of every list per item (supplier_prices) is kept up to date in
+    the same reductions. item_aliases ({item_key: group key}) merges items
+    the lists code differently, e.g. confirmed description matches.
+    """
+
+    def __init__(self, cache=None, reader=DEFAULT_READER):
+        self.cache = cache
+        self.reader = reader
+        self.offers = {}  # file -> normalized offers, in insertion order
+        self.item_aliases = {}
+        self.best, self.supplier_prices = reduce_offers_with_prices([])
+
+    def __contains__(self, file):
+        return file in self.offers
+
+    def __len__(self):
+        return len(self.offers)
+
+    @property
+    def files(self):
+        return list(self.offers)
+
+    def add_offers(self, file, offers):
+        if file in self.offers:
+            self.remove_price_lists([file])
+        self.offers[file] = offers
+        self.best, self.supplier_prices = reduce_offers_with_prices(
+            [self.best, apply_item_aliases(offers, self.item_aliases)], [self.supplier_prices, None])
+
+    def add_price_list(self, mapping):
+        offers = read_price_list(mapping, self.cache, self.reader)
+        offers.attrs.pop('normalize_seconds', None)
+        offers.attrs.pop('normalize_rows', None)
+        self.add_offers(mapping['file'], offers)
+
+    def add_price_lists(self, mappings, max_workers=None, on_error=None, progress=None, cancel=None, metrics=None,
+                        opened=None):
+        """
+        Read mappings in parallel and merge them in their given order.
+        If the read is cancelled nothing is merged and ComparisonCancelled is raised.
+        With a StageMetrics the read and the merge are recorded as 'read' and
+        'reduce', and the key normalization done during the read as
+        'normalize' (summed over the lists, so over the workers when parallel).
+        opened ({file: open_sheet_head result}) is read instead of opening
+        those files again; whatever is not read from it is closed.
+        """
+        opened = dict(opened or {})
+        try:
+            with measure(metrics, 'read') as record:
+                frames = read_price_lists(mappings, max_workers, self.cache, on_error, self.reader, progress, cancel, opened)
+                record['rows'] = sum(len(offers) for offers in frames if offers is not None)
+        finally:
+            for _, _, rows in opened.values():
+                rows.close()
+        # Lists loaded from the cache were not normalized again
+        read = [offers for offers in frames if offers is not None and 'normalize_seconds' in offers.attrs]
+        seconds = sum(offers.attrs.pop('normalize_seconds') for offers in read)
+        rows = sum(offers.attrs.pop('normalize_rows') for offers in read)
+        if metrics is not None:
+            metrics.add_timed('normalize', seconds, rows)
+        with measure(metrics, 'reduce') as record:
+            for mapping, offers in zip(mappings, frames):
+                if offers is not None:
+                    self.add_offers(mapping['file'], offers)
+            record['rows'] = len(self.best)
+
+    def remove_price_lists(self, files):
+        removed = [f for f in files if self.offers.pop(f, None) is not None]
+        if removed:
+            self._reduce_all()
+
+    def set_item_aliases(self, aliases):
+        """Replace item_aliases and recompute the best offers from the lists in memory."""
+        self.item_aliases = dict(aliases)
+        self._reduce_all()
+
+    def _reduce_all(self):
+        self.best, self.supplier_prices = reduce_offers_with_prices(
+            [apply_item_aliases(offers, self.item_aliases) for offers in self.offers.values()])
+
+    def unparsed_prices(self, files=None):
+        """{file: merge_unparsed summary} of the loaded lists with rows whose price could not be read."""
+        summaries = {}
+        for file in self.offers if files is None else files:
+            summary = merge_unparsed([self.offers[file].attrs.get('unparsed_prices')]) if file in self.offers else None
+            if summary and summary['count']:
+                summaries[file] = summary
+        return summaries
+
+    def memory_usage(self):
+        """
+        Bytes held by the offers of the loaded lists and the current best,
+        as pandas counts them (deep, so shared strings count every time).
+        """
+        frames = list(self.offers.values()) + [self.best]
+        return int(sum(frame.memory_usage(deep=True).sum() for frame in frames) + self.supplier_prices.prices.nbytes)
+
+    def clear(self):
+        self.offers = {}
+        self.best, self.supplier_prices = reduce_offers_with_prices([])
+
+    def results(self):
+        return results_from_offers(sort_best_offers(self.best))
+
+    def results_frame(self):
+        return results_frame_from_offers(sort_best_offers(self.best))
+
+    def price_matrix_frame(self):
+        """
+        The item x supplier price matrix, rows in the results order: item,
+        description, one price column per list (named after the file, NaN
+        when the list does not have the item), then best_price,
+        second_price, spread and suppliers.
+        """
+        order = best_offers_order(self.best)
+        best = self.best.iloc[order]
+        prices = SupplierPrices(self.supplier_prices.files, self.supplier_prices.prices[order])
+        columns = {'item': best['original_item'].to_numpy(dtype=object),
+                   'description': best['description'].to_numpy(dtype=object)}
+        for i, name in enumerate(supplier_names(prices.files)):
+            columns[name] = prices.prices[:, i]
+        columns.update(prices.summary())
+        return pd.DataFrame(columns)
+
+
+def supplier_names(files):
+    """Column names for the lists: the file name, the full path when two lists share it."""
+    names = [os.path.basename(f) for f in files]
+    return [name if names.count(name) == 1 else file for name, file in zip(names, files)]
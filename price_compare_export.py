@@ -0,0 +1,205 @@
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+# CSV export of comparison results, shared by the GUI and the command line.
+
+LOWEST_PRICE_LABEL = 'Lowest Price'
+SOURCE_FILE_LABEL = 'Source File'
+# Only in the temporary results, to restore the discount totals on reload
+SECOND_PRICE_LABEL = 'Second Price'
+RESULT_COLUMNS = ['Item', 'Description', LOWEST_PRICE_LABEL, 'Quantity', SOURCE_FILE_LABEL]
+COMBINED_CSV_NAME = 'result_compared.csv'
+MATRIX_CSV_NAME = 'price_matrix.csv'
+# Headers of the fixed columns of the price matrix, the list columns keep their file name
+MATRIX_LABELS = {'item': 'Item', 'description': 'Description', 'best_price': 'Best Price',
+                 'second_price': SECOND_PRICE_LABEL, 'spread': 'Spread', 'suppliers': 'Suppliers'}
+
+
+def price_text(price):
+    # Whole numbers without '.0', as the cells of the lists were written (120, not 120.0)
+    if isinstance(price, float) and price.is_integer():
+        return str(int(price))
+    return f"{price}"
+
+
+def format_price(price, dec_sep, thou_sep):
+    return price_text(price).replace(',', 'X').replace('.', dec_sep).replace('X', thou_sep)
+
+
+def format_price_column(prices, dec_sep, thou_sep):
+    """
+    format_price over a whole column in one pass. Floats are written with the
+    same shortest repr as f"{price}" (whole numbers without '.0'), missing
+    prices of a float column as ''.
+    """
+    prices = pd.Series(prices).reset_index(drop=True)
+    if pd.api.types.is_float_dtype(prices.dtype):
+        text = [price_text(p) for p in prices.tolist()]
+    else:
+        text = [price_text(p) if isinstance(p, float) else t
+                for p, t in zip(prices.tolist(), _text_column(prices).tolist())]
+    text = np.array([t.replace(',', 'X').replace('.', dec_sep).replace('X', thou_sep) for t in text], dtype=object)
+    if pd.api.types.is_float_dtype(prices.dtype):
+        text[prices.isna().to_numpy()] = ''
+    return text
+
+
+def _text_column(values):
+    # Cells as csv.writer writes them: None -> '', everything else str()
+    values = pd.Series(values, dtype=object).to_numpy()
+    if pd.api.types.infer_dtype(values, skipna=False) == 'string':
+        return values
+    text = np.array([str(v) for v in values], dtype=object)
+    text[np.equal(values, None)] = ''
+    return text
+
+
+def _write_csv(path, header, columns, sep):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, delimiter=sep)
+        writer.writerow(header)
+        writer.writerows(zip(*[column.tolist() for column in columns]))
+
+
+def save_compared_csvs(folder_path, rows, sep, dec_sep, thou_sep, only_with_quantity=True, on_error=None):
+    """
+    Write result_compared.csv and one <source>_compared.csv per source file.
+    rows is a DataFrame (or a list of dicts) with item, description, price,
+    quantity and file (the source file name). With only_with_quantity, rows
+    without a quantity (or with 0) are left out. on_error(path, exception) is
+    called for files that cannot be written. Returns the paths written.
+    """
+    if not isinstance(rows, pd.DataFrame):
+        rows = pd.DataFrame(list(rows), columns=['item', 'description', 'price', 'quantity', 'file'])
+    # Filter once, on the distinct quantities, then format only the rows kept
+    quantity = _text_column(rows['quantity'])
+    files = _text_column(rows['file'])
+    source_codes, sources = pd.factorize(pd.Series(files, dtype=object), sort=False)
+    keep = np.arange(len(rows))
+    if only_with_quantity:
+        quantity_codes, quantities = pd.factorize(pd.Series(quantity, dtype=object), sort=False)
+        kept_quantities = np.array([q.strip() not in ('', '0') for q in quantities], dtype=bool)
+        keep = np.flatnonzero(kept_quantities[quantity_codes])
+    columns = [_text_column(rows['item'].to_numpy()[keep]), _text_column(rows['description'].to_numpy()[keep]),
+               format_price_column(rows['price'].iloc[keep], dec_sep, thou_sep), quantity[keep], files[keep]]
+    written = []
+    combined_path = os.path.join(folder_path, COMBINED_CSV_NAME)
+    try:
+        _write_csv(combined_path, RESULT_COLUMNS, columns, sep)
+        written.append(combined_path)
+    except Exception as e:
+        if on_error is not None:
+            on_error(combined_path, e)
+    # Save one CSV per source Excel file (also when none of its rows is kept), rows grouped by a stable sort
+    source_codes = source_codes[keep]
+    order = np.argsort(source_codes, kind='stable')
+    bounds = np.searchsorted(source_codes[order], np.arange(len(sources) + 1))
+    for code, source_file in enumerate(sources):
+        group = order[bounds[code]:bounds[code + 1]]
+        base_name = os.path.splitext(os.path.basename(source_file))[0]
+        csv_path = os.path.join(folder_path, f"{base_name}_compared.csv")
+        try:
+            _write_csv(csv_path, RESULT_COLUMNS[:4], [column[group] for column in columns[:4]], sep)
+            written.append(csv_path)
+        except Exception as e:
+            if on_error is not None:
+                on_error(csv_path, e)
+    return written
+
+
+def save_temporary_csv(file_path, rows, sep, dec_sep, thou_sep):
+    """
+    Write every result row, with the source file and the second best price,
+    so that a session can be loaded back. rows is a DataFrame like for
+    save_compared_csvs plus second_price.
+    """
+    columns = [_text_column(rows['item']), _text_column(rows['description']),
+               format_price_column(rows['price'], dec_sep, thou_sep), _text_column(rows['quantity']),
+               _text_column(rows['file']), format_price_column(rows['second_price'], dec_sep, thou_sep)]
+    _write_csv(file_path, RESULT_COLUMNS + [SECOND_PRICE_LABEL], columns, sep)
+
+
+def save_price_matrix_csv(file_path, matrix, sep, dec_sep, thou_sep):
+    """
+    Write the frame of PriceComparison.price_matrix_frame(): every price
+    column formatted like the other exports, a missing price left empty.
+    """
+    columns = []
+    for column in matrix.columns:
+        if column in ('item', 'description'):
+            columns.append(_text_column(matrix[column]))
+        elif column == 'suppliers':
+            columns.append(matrix[column].to_numpy().astype(str).astype(object))
+        else:
+            columns.append(format_price_column(matrix[column], dec_sep, thou_sep))
+    _write_csv(file_path, [MATRIX_LABELS.get(column, column) for column in matrix.columns], columns, sep)
+
+
+def _blank_cells(text):
+    return np.isin(np.char.strip(text), ['', 'nan', 'NaN', 'NAN'])
+
+
+def parse_price_column(values, dec_sep, thou_sep):
+    """
+    Saved prices back to floats, a whole column at a time with numpy's
+    np.char string functions (NumPy 1 and 2). Blank cells give '', text that
+    is not a number is kept as it is.
+    """
+    text = np.array(pd.Series(values, dtype=object).fillna('').tolist(), dtype=str)
+    blank = _blank_cells(text)
+    numbers = text
+    if thou_sep:
+        numbers = np.char.replace(numbers, thou_sep, '')
+    if dec_sep != '.':
+        numbers = np.char.replace(numbers, dec_sep, '.')
+    # numpy converts exactly like float() (to_numeric can be off by an ulp); to_numeric only finds the numbers
+    valid = pd.to_numeric(pd.Series(numbers, dtype=object), errors='coerce').notna().to_numpy() & ~blank
+    prices = text.astype(object)
+    prices[valid] = numbers[valid].astype(float).tolist()
+    prices[blank] = ''
+    return prices
+
+
+def load_results_csv(file_path, sep, dec_sep, thou_sep):
+    """
+    Read a file written by save_temporary_csv (or result_compared.csv) into
+    the columns of ResultsModel.from_frame. Raises ValueError if the Item,
+    Description or Lowest Price column is missing.
+    """
+    price_columns = [LOWEST_PRICE_LABEL, SECOND_PRICE_LABEL]
+    header = pd.read_csv(file_path, delimiter=sep, nrows=0).columns
+    if not all(column in header for column in RESULT_COLUMNS[:3]):
+        raise ValueError(f'CSV file does not contain expected columns (Item, Description, {LOWEST_PRICE_LABEL}).')
+    # The C parser converts the price columns itself (exactly, with the configured separators);
+    # every other cell is read as text, blanks as ''
+    df = pd.read_csv(
+        file_path, delimiter=sep,
+        dtype={column: str for column in header if column not in price_columns},
+        decimal=dec_sep, thousands=thou_sep or None, float_precision='round_trip',
+        keep_default_na=False, na_values={column: ['', 'nan', 'NaN', 'NAN'] for column in price_columns},
+    )
+    prices = {}
+    for column in price_columns:
+        if column not in df.columns:
+            continue
+        if pd.api.types.is_numeric_dtype(df[column].dtype):
+            values = df[column].to_numpy(dtype=float).astype(object)
+            values[np.isnan(df[column].to_numpy(dtype=float))] = ''
+            prices[column] = values
+        else:
+            # Some cells are not numbers: parse the column as text
+            prices[column] = parse_price_column(df[column], dec_sep, thou_sep)
+    blank = pd.Series([''] * len(df), dtype=object)
+    quantity = (df[RESULT_COLUMNS[3]] if RESULT_COLUMNS[3] in df.columns else blank).to_numpy(dtype=object)
+    quantity[_blank_cells(np.array(quantity.tolist(), dtype=str))] = ''
+    return pd.DataFrame({
+        'item': df[RESULT_COLUMNS[0]].to_numpy(dtype=object),
+        'description': df[RESULT_COLUMNS[1]].to_numpy(dtype=object),
+        'price': prices[LOWEST_PRICE_LABEL],
+        'quantity': quantity,
+        'file': (df[SOURCE_FILE_LABEL] if SOURCE_FILE_LABEL in df.columns else blank).to_numpy(dtype=object),
+        'second_price': prices.get(SECOND_PRICE_LABEL, np.nan),
+    })
@@ -3,19 +3,52 @@ from tkinter import filedialog, messagebox, ttk
 import pandas as pd
 import json
 import os
+import threading
+from price_compare_engine import (PriceComparison, ComparisonCancelled, MappingNotDetected, DEFAULT_READER, DEFAULT_PRICE_FORMAT,
+                                  PRICE_FORMAT_KEYS, describe_unparsed, is_pdf, open_sheet_head, preview_frame, read_preview)
+from price_compare_export import (LOWEST_PRICE_LABEL, SOURCE_FILE_LABEL, MATRIX_CSV_NAME, MATRIX_LABELS, save_compared_csvs,
+                                  save_temporary_csv, save_price_matrix_csv, load_results_csv)
+from price_list_cache import PriceListCache, DEFAULT_CACHE_MAX_MB
+from description_matching import MATCH_THRESHOLD, DEFAULT_MATCHES_FILE, MatchDecisions, find_description_matches
+from price_history import DEFAULT_HISTORY_FILE, PriceHistory
+from mapping_profiles import DEFAULT_PROFILES_FILE, MappingProfiles, detect_mapping
+from results_model import RESULT_KEYS, ResultsModel
+from results_search import ResultsSearchIndex
+from results_totals import RunningTotals
+from stage_metrics import STAGE_LABELS, StageMetrics, measure
+from virtual_treeview import VirtualTreeview
 
 CONFIG_FILE = 'config.json'
 CSV_MENU_LABEL = 'Salva risultati come CSV'
 TEMP_MENU_LABEL = 'Salva risultati temporanei'
-LOWEST_PRICE_LABEL = 'Lowest Price'
-SOURCE_FILE_LABEL = 'Source File'
+# File menu entries that read or change the comparison, disabled while a worker thread updates it
+BUSY_MENU_LABELS = ('Carica risultati da CSV', 'Matrice prezzi fornitori', 'Abbinamenti per descrizione', 'Storico prezzi')
 
 class PriceCompareApp:
     def __init__(self, root):
         self.root = root
         self.root.title('Confronta prezzi')
         self.files = []
+        # True while a worker thread is changing self.comparison
+        self.busy = False
+        # file -> open_sheet_head of a previewed workbook, read on by its comparison
+        self.opened_sheets = {}
         self.config = self.load_config()
+        self.cache = PriceListCache.from_config(self.config)
+        self.comparison = PriceComparison(cache=self.cache, reader=self.config.get('excel_reader', DEFAULT_READER))
+        # Time, rows and peak memory of every stage, shown in the status bar (and logged if metrics_log is on)
+        self.metrics = StageMetrics.from_config(self.config)
+        # Confirmed column mappings, applied again to lists with the same header layout
+        self.profiles = MappingProfiles.from_config(self.config)
+        # Confirmed description matches merge items the lists code differently
+        self.match_decisions = MatchDecisions.from_config(self.config)
+        self.comparison.set_item_aliases(self.match_decisions.aliases())
+        # Every compared list is kept as an import in the price history (price_history in config.json)
+        try:
+            self.history = PriceHistory.from_config(self.config)
+        except Exception as e:
+            self.history = None
+            messagebox.showwarning('Warning', f'Storico prezzi non disponibile: {e}')
         self.setup_ui()
 
     def load_config(self):
@@ -25,7 +58,11 @@ class PriceCompareApp:
                     return json.load(f)
             except Exception:
                 pass
-        return {'csv_separator': ',', 'decimal_separator': '.', 'thousands_separator': ','}
+        return {'csv_separator': ',', 'decimal_separator': '.', 'thousands_separator': ',', 'cache_max_mb': DEFAULT_CACHE_MAX_MB, 'max_workers': 0, 'excel_reader': DEFAULT_READER,
+                'currency_symbols': DEFAULT_PRICE_FORMAT['currency_symbols'], 'metrics_log': False,
+                'auto_mapping': True, 'mapping_profiles_file': DEFAULT_PROFILES_FILE,
+                'description_match_threshold': MATCH_THRESHOLD, 'description_matches_file': DEFAULT_MATCHES_FILE,
+                'price_history': True, 'price_history_file': DEFAULT_HISTORY_FILE}
 
     def save_config(self):
         try:
@@ -43,18 +80,28 @@ class PriceCompareApp:
         menubar.add_cascade(label='File', menu=file_menu)
         file_menu.add_command(label=CSV_MENU_LABEL, command=self.save_results, state='disabled')
         file_menu.add_command(label=TEMP_MENU_LABEL, command=self.save_temporary_results, state='disabled')
-        file_menu.add_command(label='Carica risultati da CSV', command=self.load_results_from_csv)
+        file_menu.add_command(label=BUSY_MENU_LABELS[0], command=self.load_results_from_csv)
+        file_menu.add_command(label=BUSY_MENU_LABELS[1], command=self.show_price_matrix)
+        file_menu.add_command(label=BUSY_MENU_LABELS[2], command=self.show_description_matches)
+        file_menu.add_command(label=BUSY_MENU_LABELS[3], command=self.show_price_history)
         file_menu.add_separator()
         file_menu.add_command(label='Esci', command=self.root.quit)
         # Config menu
         config_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label='Configurazione', menu=config_menu)
         config_menu.add_command(label='Impostazioni', command=self.open_config_dialog)
+        config_menu.add_command(label='Svuota cache listini', command=self.clear_cache)
+        config_menu.add_command(label='Diagnostica prestazioni', command=self.show_diagnostics)
+        config_menu.add_command(label='Dimentica profili colonne', command=self.clear_profiles)
         # Store menu items for enabling/disabling
         self.menu_save_results = file_menu.entryconfig(CSV_MENU_LABEL, state='disabled')
         self.menu_save_temp = file_menu.entryconfig(TEMP_MENU_LABEL, state='disabled')
+        # Status bar with the stages of the last operation, packed first so it stays at the bottom
+        self.status_var = tk.StringVar(value='')
+        ttk.Label(self.root, textvariable=self.status_var, relief=tk.SUNKEN, anchor='w').pack(side=tk.BOTTOM, fill=tk.X)
         frame = ttk.Frame(self.root, padding=10)
         frame.pack(fill=tk.BOTH, expand=True)
+        self.main_frame = frame
 
         # --- Button row for file selection ---
         btn_row = ttk.Frame(frame)
@@ -67,6 +114,9 @@ class PriceCompareApp:
         # self.add_btn = ttk.Button(btn_row, text='Aggiungi listino', command=self.add_file)
         # self.add_btn.pack(side=tk.LEFT, padx=2)
 
+        self.remove_btn = ttk.Button(btn_row, text='Rimuovi listino', command=self.remove_files)
+        self.remove_btn.pack(side=tk.LEFT, padx=2)
+
         self.clear_btn = ttk.Button(btn_row, text='Svuota lista', command=self.clear_files)
         self.clear_btn.pack(side=tk.LEFT, padx=2)
 
@@ -91,7 +141,9 @@ class PriceCompareApp:
         self.file_menu = file_menu
 
     def select_files(self):
-        files = filedialog.askopenfilenames(filetypes=[('Excel Files', '*.xlsx;*.xls')])
+        # PDF price lists are read directly: their tables go to the comparison without an xlsx in between
+        files = filedialog.askopenfilenames(filetypes=[('Listini (Excel, PDF)', '*.xlsx;*.xls;*.pdf'),
+                                                       ('Excel Files', '*.xlsx;*.xls'), ('PDF Files', '*.pdf')])
         if files:
             new_files = [f for f in files if f not in self.files]
             duplicate_files = [f for f in files if f in self.files]
@@ -120,20 +172,59 @@ class PriceCompareApp:
             self._show_no_valid_file_message()
 
     def _add_file_column_mapping(self, file):
+        if self.config.get('auto_mapping', True):
+            # Mapped by the read itself on the rows it streams, so the workbook is parsed once: a saved
+            # profile for its header layout, else a confident guess. The others are asked after the read.
+            self.file_column_mappings.append({'file': file, 'header_idx': None, 'profiles': dict(self.profiles.profiles),
+                                              **{key: self.config.get(key) for key in PRICE_FORMAT_KEYS}})
+            return
+        self._ask_file_column_mapping(file)
+
+    def _ask_file_column_mapping(self, file):
+        # A saved profile for the header layout of the preview, else the dialogs prefilled with a guess.
+        # Returns True if the file was mapped.
         try:
-            item_col, price_col, description_col, header_idx = self.ask_column_mapping_with_header(file)
-            if item_col is None or price_col is None or description_col is None:
-                messagebox.showwarning('Warning', f'Salto file: {file}')
-                return
+            preview_df = self._load_preview(file)
+            if preview_df is None:
+                return False
+            rows = preview_df.values.tolist()
+            suggested = self.profiles.match(rows)
+            if suggested is None:
+                item_col, price_col, description_col, header_idx = self.ask_column_mapping_with_header(
+                    file, preview_df, detect_mapping(rows))
+                if item_col is None or price_col is None or description_col is None:
+                    self._close_opened([file])
+                    messagebox.showwarning('Warning', f'Salto file: {file}')
+                    return False
+                try:
+                    self.profiles.remember(rows, {'header_idx': header_idx, 'item_col': item_col, 'price_col': price_col,
+                                                  'description_col': description_col}, os.path.basename(file))
+                except OSError as e:
+                    messagebox.showwarning('Warning', f'Profilo colonne non salvato: {e}')
+            else:
+                item_col, price_col, description_col, header_idx = (
+                    suggested['item_col'], suggested['price_col'], suggested['description_col'], suggested['header_idx'])
             self.file_column_mappings.append({
                 'file': file,
                 'item_col': item_col,
                 'price_col': price_col,
                 'description_col': description_col,
-                'header_idx': header_idx
+                'header_idx': header_idx,
+                # Text prices are read with the configured separators and currency symbols
+                **{key: self.config.get(key) for key in PRICE_FORMAT_KEYS}
             })
+            return True
         except Exception as e:
+            self._close_opened([file])
             messagebox.showerror('Error', f'Impossibile leggere {file}: {e}')
+            return False
+
+    def _ask_undetected(self, files):
+        # Lists the read could not map: their columns are asked now and they are compared again
+        self.file_column_mappings = [m for m in self.file_column_mappings if m['file'] not in files]
+        asked = [file for file in files if self._ask_file_column_mapping(file)]
+        if asked:
+            self.compare_and_display()
 
     def _show_no_valid_file_message(self):
         self.result_box.config(state=tk.NORMAL)
@@ -145,9 +236,45 @@ class PriceCompareApp:
 
     # Remove add_file method
 
+    def remove_files(self):
+        if not self.files:
+            messagebox.showinfo('Info', 'Nessun listino selezionato.')
+            return
+        dialog = tk.Toplevel(self.root)
+        dialog.title('Rimuovi listino')
+        dialog.grab_set()
+        tk.Label(dialog, text='Seleziona i listini da rimuovere:').pack(pady=5)
+        listbox = tk.Listbox(dialog, selectmode=tk.MULTIPLE, width=60, height=min(len(self.files), 15))
+        for file in self.files:
+            listbox.insert(tk.END, file.split('/')[-1])
+        listbox.pack(padx=10, pady=5)
+        selected = []
+        def on_ok():
+            selected.extend(self.files[i] for i in listbox.curselection())
+            dialog.destroy()
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(pady=5)
+        ttk.Button(btn_frame, text='OK', command=on_ok).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text='Annulla', command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+        dialog.wait_window()
+        if not selected:
+            return
+        if len(selected) == len(self.files):
+            self.clear_files()
+            return
+        self.files = [f for f in self.files if f not in selected]
+        self.file_column_mappings = [m for m in self.file_column_mappings if m['file'] not in selected]
+        # Only the lists already in memory are reduced again, nothing is re-read
+        self.comparison.remove_price_lists(selected)
+        self.files_label.config(text=f'File selezionati: {len(self.files)}')
+        self.compare_and_display()
+
     def clear_files(self):
         self.files = []
         self.file_column_mappings = []
+        self._close_opened()
+        self.comparison.clear()
+        self.results_model = None
         self.files_label.config(text='Nessun listino selezionato.')
         # Remove result widgets if any
         if hasattr(self, 'result_tree') and self.result_tree:
@@ -172,14 +299,47 @@ class PriceCompareApp:
         self.file_menu.entryconfig(CSV_MENU_LABEL, state='disabled')
         self.file_menu.entryconfig(TEMP_MENU_LABEL, state='disabled')
 
-    def ask_column_mapping_with_header(self, file):
-        import pandas as pd
-        # Read the first 20 rows for preview
+    def clear_cache(self):
+        if not messagebox.askyesno('Conferma', 'Eliminare tutti i listini salvati nella cache?'):
+            return
+        freed = self.cache.clear()
+        messagebox.showinfo('Info', f'Cache svuotata ({freed / (1024 * 1024):.1f} MB liberati).')
+
+    def clear_profiles(self):
+        if not messagebox.askyesno('Conferma', f'Dimenticare i {len(self.profiles)} profili colonne salvati?'):
+            return
+        try:
+            self.profiles.clear()
+        except OSError as e:
+            messagebox.showerror('Error', f'Impossibile salvare i profili: {e}')
+
+    def _load_preview(self, file):
+        # The first 20 rows, shared by the profiles and the mapping dialog. An Excel file is kept open in
+        # self.opened_sheets, so its full read goes on from the same parse instead of loading it again.
         try:
-            preview_df = pd.read_excel(file, nrows=20, header=None)
+            preview_df = self.cache.load_preview(file, 20)
+            if preview_df is None:
+                if is_pdf(file):
+                    preview_df = read_preview(file, 20, self.cache)
+                else:
+                    self.opened_sheets[file] = open_sheet_head(file, 20)
+                    preview_df = preview_frame(self.opened_sheets[file][1])
+                self.cache.store_preview(file, 20, preview_df)
+            return preview_df
         except Exception as e:
+            self._close_opened([file])
             messagebox.showerror('Error', f'Impossibile visualizzare {file}: {e}')
-            return None, None, None, None
+            return None
+
+    def _close_opened(self, files=None):
+        # Workbooks opened for a preview whose full read will not happen
+        for file in list(self.opened_sheets) if files is None else files:
+            opened = self.opened_sheets.pop(file, None)
+            if opened is not None:
+                opened[2].close()
+
+    def ask_column_mapping_with_header(self, file, preview_df, suggested=None):
+        # suggested (detect_mapping) preselects the header row and the columns
         dialog = tk.Toplevel(self.root)
         dialog.title(f'Seleziona la riga di intestazione per {file.split("/")[-1]}')
         dialog.grab_set()
@@ -202,9 +362,10 @@ class PriceCompareApp:
         tree.tag_configure('header_evenrow', background='#f2f2f2')
         tree.tag_configure('header_oddrow', background='#ffffff')
         tree.pack(pady=5)
-        # Select first row by default
-        tree.selection_set(tree.get_children()[0])
-        header_row_idx = [0]
+        # Select the detected header row, else the first row
+        header_row_idx = [suggested['header_idx'] if suggested else 0]
+        tree.selection_set(tree.get_children()[header_row_idx[0]])
+        tree.see(tree.get_children()[header_row_idx[0]])
         def on_tree_select(event=None):
             sel = tree.selection()
             if sel:
@@ -223,19 +384,24 @@ class PriceCompareApp:
         dialog2.title(f'Seleziona le colonne per {file.split("/")[-1]}')
         dialog2.grab_set()
         tk.Label(dialog2, text=f'Seleziona le colonne per il file:\n{file}').pack(pady=5)
+        def initial(key):
+            # The detected column when the detected header row was kept
+            if suggested and suggested['header_idx'] == header_idx and suggested[key] in columns:
+                return suggested[key]
+            return columns[0] if columns else ''
         tk.Label(dialog2, text='Codice articolo/EAN:').pack()
         item_var = tk.StringVar(dialog2)
-        item_var.set(columns[0] if columns else '')
+        item_var.set(initial('item_col'))
         item_menu = ttk.Combobox(dialog2, textvariable=item_var, values=columns, state='readonly')
         item_menu.pack(pady=2)
         tk.Label(dialog2, text='Prezzo:').pack()
         price_var = tk.StringVar(dialog2)
-        price_var.set(columns[0] if columns else '')
+        price_var.set(initial('price_col'))
         price_menu = ttk.Combobox(dialog2, textvariable=price_var, values=columns, state='readonly')
         price_menu.pack(pady=2)
         tk.Label(dialog2, text='Descrizione:').pack()
         description_var = tk.StringVar(dialog2)
-        description_var.set(columns[0] if columns else '')
+        description_var.set(initial('description_col'))
         description_menu = ttk.Combobox(dialog2, textvariable=description_var, values=columns, state='readonly')
         description_menu.pack(pady=2)
         result = {'item': None, 'price': None, 'description': None}
@@ -254,53 +420,145 @@ class PriceCompareApp:
         return result['item'], result['price'], result['description'], header_idx
 
     def compare_and_display(self):
-        # Read all items and prices
-        all_items = []  # List of dicts: {item, price, file, original_item}
-        for mapping in self.file_column_mappings:
+        if self._refuse_if_busy():
+            return
+        # Read only the price lists not merged yet; the others are already in self.comparison
+        pending = [m for m in getattr(self, 'file_column_mappings', []) if m['file'] not in self.comparison]
+        self._first_stage = len(self.metrics.records)
+        if not pending:
+            self._show_comparison_results(ResultsModel.from_frame(self.comparison.results_frame()))
+            return
+        # Parse the workbooks in a worker thread so the window stays responsive
+        self.cancel_event = threading.Event()
+        opened = {m['file']: self.opened_sheets.pop(m['file']) for m in pending if m['file'] in self.opened_sheets}
+        self._show_compare_progress(len(pending))
+        threading.Thread(target=self._compare_in_background, args=(pending, opened), daemon=True).start()
+
+    def _compare_in_background(self, pending, opened):
+        errors = []
+        undetected = []
+        def on_error(file, e):
+            if isinstance(e, MappingNotDetected):
+                undetected.append(file)
+            else:
+                errors.append(f'Impossibile processare {file}: {e}')
+        def on_progress(files_done, files_total, rows_read, row_count):
+            self.root.after(0, self._update_compare_progress, files_done, files_total, rows_read, row_count)
+        # Whatever happens, one callback reaches the Tk thread and ends the busy state
+        done = None
+        try:
             try:
-                df = pd.read_excel(
-                    mapping['file'],
-                    usecols=[mapping['item_col'], mapping['price_col'], mapping['description_col']],
-                    header=mapping['header_idx']
+                self.comparison.add_price_lists(
+                    pending,
+                    max_workers=self.config.get('max_workers', 0),
+                    on_error=on_error,
+                    progress=on_progress,
+                    cancel=self.cancel_event,
+                    metrics=self.metrics,
+                    opened=opened
                 )
-                for _, row in df.iterrows():
-                    # Try to treat item as a number if possible
-                    item_cell = row[mapping['item_col']]
-                    if pd.isna(item_cell):
-                        original_item = ''
-                        item_key = ''
-                    else:
-                        try:
-                            # Try integer first, then float
-                            if float(item_cell).is_integer():
-                                original_item = int(item_cell)
-                            else:
-                                original_item = int(float(item_cell))
-                            item_key = str(original_item)
-                        except Exception:
-                            original_item = str(item_cell)
-                            item_key = original_item.strip().lower()
-                    price_cell = row[mapping['price_col']]
-                    description_cell = row[mapping['description_col']]
-                    # If price is missing or empty, treat as zero
-                    if pd.isna(price_cell) or str(price_cell).strip() == '':
-                        price = 0.0
-                    else:
-                        price = price_cell
-                    all_items.append({'item_key': item_key, 'price': price, 'file': mapping['file'], 'original_item': original_item, 'description': description_cell})
+            except ComparisonCancelled:
+                done = (self._on_compare_cancelled, pending)
+                return
             except Exception as e:
-                messagebox.showerror('Error', f'Impossibile processare {mapping["file"]}: {e}')
-        # Find lowest price for each item (case-insensitive, stripped)
-        best_prices = {}
-        for entry in all_items:
-            item_key = entry['item_key']
-            if item_key not in best_prices or entry['price'] < best_prices[item_key]['price']:
-                best_prices[item_key] = {'price': entry['price'], 'file': entry['file'], 'original_item': entry['original_item'], 'description': entry['description']}
-        # Prepare results for display
-        results = []
-        for item_key, data in sorted(best_prices.items(), key=lambda x: str(x[1]['description']).lower()):
-            results.append({'item': data['original_item'], 'price': data['price'], 'description': data['description'], 'file': data['file']})
-        self.display_results(results)
+                errors.append(f'Errore durante il confronto: {e}')
+            if self.history is not None:
+                # Only new or changed lists are stored; an unchanged file is recognized by its size and date
+                with measure(self.metrics, 'history') as record:
+                    record['imports'] = self.history.ingest_comparison(
+                        self.comparison, pending, on_error=lambda file, e: errors.append(f'Storico prezzi, {file}: {e}'))
+            warnings = [describe_unparsed(file, summary)
+                        for file, summary in self.comparison.unparsed_prices([m['file'] for m in pending]).items()]
+            with measure(self.metrics, 'results_model') as record:
+                results = ResultsModel.from_frame(self.comparison.results_frame())
+                record['rows'] = len(results)
+            with measure(self.metrics, 'search_index', len(results)):
+                search_index = ResultsSearchIndex(results)
+            memory = self.comparison.memory_usage()
+            done = (self._on_compare_done, results, errors, search_index, warnings, memory, undetected)
+        except Exception as e:
+            done = (self._on_compare_failed, errors + [f'Errore durante il confronto: {e}'])
+        finally:
+            if done is None:
+                done = (self._on_compare_failed, errors + ['Confronto interrotto.'])
+            self.root.after(0, *done)
+
+    def _on_compare_failed(self, errors):
+        self._hide_compare_progress()
+        messagebox.showerror('Error', '\n'.join(errors))
+
+    def _set_busy(self, busy):
+        # The buttons and the menu entries that use self.comparison are off while a worker changes it
+        self.busy = busy
+        state = tk.DISABLED if busy else tk.NORMAL
+        for btn in (self.select_btn, self.remove_btn, self.clear_btn):
+            btn.config(state=state)
+        for label in BUSY_MENU_LABELS:
+            self.file_menu.entryconfig(label, state=state)
+
+    def _refuse_if_busy(self, parent=None):
+        # For windows opened before the worker started (Applica, Confronto alla data)
+        if self.busy:
+            messagebox.showinfo('Info', 'Confronto in corso, riprovare al termine.', parent=parent or self.root)
+        return self.busy
+
+    def _show_compare_progress(self, total_files):
+        self._set_busy(True)
+        self.progress_frame = ttk.Frame(self.main_frame)
+        self.progress_frame.pack(pady=5)
+        self.files_progress = ttk.Progressbar(self.progress_frame, orient='horizontal', length=300, mode='determinate', maximum=total_files)
+        self.files_progress.pack(pady=2)
+        self.rows_progress = ttk.Progressbar(self.progress_frame, orient='horizontal', length=300, mode='determinate')
+        self.rows_progress.pack(pady=2)
+        self.progress_label = ttk.Label(self.progress_frame, text=f'Lettura di {total_files} listini...')
+        self.progress_label.pack(pady=2)
+        self.cancel_btn = ttk.Button(self.progress_frame, text='Annulla', command=self.cancel_compare)
+        self.cancel_btn.pack(pady=2)
+
+    def _update_compare_progress(self, files_done, files_total, rows_read, row_count):
+        if not getattr(self, 'progress_frame', None) or self.cancel_event.is_set():
+            return
+        self.files_progress['value'] = files_done
+        self.rows_progress['maximum'] = max(row_count, rows_read, 1)
+        self.rows_progress['value'] = rows_read
+        self.progress_label.config(text=f'Listini letti {files_done}/{files_total} - righe {rows_read:,}/{row_count:,}')
+
+    def _hide_compare_progress(self):
+        if getattr(self, 'progress_frame', None):
+            self.progress_frame.destroy()
+            self.progress_frame = None
+        self._set_busy(False)
+
+    def cancel_compare(self):
+        self.cancel_event.set()
+        self.cancel_btn.config(state=tk.DISABLED)
+        self.progress_label.config(text='Annullamento in corso...')
+
+    def _on_compare_cancelled(self, pending):
+        self._hide_compare_progress()
+        # The cancelled lists were not merged: drop them so they can be selected again
+        cancelled = {m['file'] for m in pending}
+        self.files = [f for f in self.files if f not in cancelled]
+        self.file_column_mappings = [m for m in self.file_column_mappings if m['file'] not in cancelled]
+        self.files_label.config(text=f'File selezionati: {len(self.files)}')
+        messagebox.showinfo('Info', 'Confronto annullato.')
+
+    def _on_compare_done(self, results, errors, search_index, warnings=(), memory=None, undetected=()):
+        self._hide_compare_progress()
+        if memory is not None:
+            self.files_label.config(text=f'File selezionati: {len(self.files)} ({memory / 1e6:.1f} MB in memoria)')
+        if errors:
+            messagebox.showerror('Error', '\n'.join(errors))
+        if warnings:
+            messagebox.showwarning('Warning', 'Prezzi mancanti o non leggibili, queste righe non sono mai l\'offerta migliore:\n' + '\n'.join(warnings))
+        self._show_comparison_results(results, search_index)
+        if undetected:
+            self._ask_undetected(undetected)
+
+    def _show_comparison_results(self, results, search_index=None):
+        with measure(self.metrics, 'display', len(results)):
+            self.display_results(results, search_index)
+        self._show_stages(getattr(self, '_first_stage', 0))
         self.comparison_results = results  # Save for CSV export
         # Enable menu items for saving if results exist
         if hasattr(self, 'root') and hasattr(self, 'menu_save_results') and hasattr(self, 'menu_save_temp'):
@@ -309,13 +567,14 @@ class PriceCompareApp:
             self.file_menu.entryconfig(CSV_MENU_LABEL, state=state)
             self.file_menu.entryconfig(TEMP_MENU_LABEL, state=state)
 
-    def display_results(self, results):
+    def display_results(self, results, search_index=None):
         """
         This function is responsible for displaying the comparison results in a Treeview widget.
         It first clears any existing result widgets, then checks if there are any results to display.
         If there are no results, it displays a message indicating so. If there are results, it hides
         the text box and creates a new Treeview widget with scrollbars to display the results.
-        The results are stored for future searching and the Treeview is populated with the results.
+        results is a ResultsModel; the Treeview only materializes the visible rows of it.
+        A search index over Item and Description is built once (unless one is passed in).
         """
         # Remove old result widgets if any
         if hasattr(self, 'result_tree') and self.result_tree:
@@ -328,6 +587,9 @@ class PriceCompareApp:
             self.result_frame.destroy()
         if hasattr(self, 'search_frame') and self.search_frame:
             self.search_frame.destroy()
+        if hasattr(self, 'total_label') and self.total_label:
+            self.total_label.destroy()
+            self.total_label = None
         # If no results, show a message
         if not results:
             self.result_box.config(state=tk.NORMAL)
@@ -340,8 +602,8 @@ class PriceCompareApp:
         self.result_box.delete(1.0, tk.END)
         self.result_box.config(state=tk.DISABLED)
         self.result_box.pack_forget()
-        # Store all results for searching
-        self._all_results = results
+        # Store the results model for searching, editing, totals and exports
+        self.results_model = results
         # Create a frame to hold the Treeview and scrollbars
         self.result_frame = ttk.Frame(self.root)
         self.result_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
@@ -351,17 +613,18 @@ class PriceCompareApp:
         style.map('Treeview.Heading', background=[('active', '#b6d7a8')])
         style.configure('evenrow', background='#f2f2f2')
         style.configure('oddrow', background='#ffffff')
-        self.result_tree = ttk.Treeview(self.result_frame, columns=columns, show='headings', height=15)
+        self.result_tree = VirtualTreeview(self.result_frame, self._result_row, columns=columns, show='headings', height=15)
         for col in columns:
             self.result_tree.heading(col, text=col)
             self.result_tree.column(col, width=150, anchor='center', stretch=True)
-        self._populate_result_tree(results)
         self.result_tree.tag_configure('evenrow', background='#f2f2f2')
         self.result_tree.tag_configure('oddrow', background='#ffffff')
+        self._populate_result_tree(results)
         # Add scrollbars
-        self.tree_scroll_y = ttk.Scrollbar(self.result_frame, orient='vertical', command=self.result_tree.yview)
+        self.tree_scroll_y = ttk.Scrollbar(self.result_frame, orient='vertical')
         self.tree_scroll_x = ttk.Scrollbar(self.result_frame, orient='horizontal', command=self.result_tree.xview)
-        self.result_tree.configure(yscrollcommand=self.tree_scroll_y.set, xscrollcommand=self.tree_scroll_x.set)
+        self.result_tree.attach_yscrollbar(self.tree_scroll_y)
+        self.result_tree.configure(xscrollcommand=self.tree_scroll_x.set)
         self.result_tree.grid(row=0, column=0, sticky='nsew')
         self.tree_scroll_y.grid(row=0, column=1, sticky='ns')
         self.tree_scroll_x.grid(row=1, column=0, sticky='ew')
@@ -379,16 +642,29 @@ class PriceCompareApp:
             col_idx = int(col_id.replace('#', '')) - 1
             x, y, width, height = self.result_tree.bbox(row_id, col_id)
             value = self.result_tree.set(row_id, columns[col_idx])
+            pos = self.result_tree.index_of(row_id)
+            index = self._model_index(pos)
             entry = tk.Entry(self.result_tree)
             entry.place(x=x, y=y, width=width, height=height)
             entry.insert(0, value)
             entry.focus()
             def save_edit(event=None):
-                self.result_tree.set(row_id, columns[col_idx], entry.get())
+                if not entry.winfo_exists():
+                    return
+                # Edits go to the model, the Treeview only shows it; totals move by the row delta
+                old_row = self.results_model.row(index)
+                try:
+                    self.results_model.set(index, RESULT_KEYS[col_idx], entry.get())
+                except ValueError as e:
+                    entry.destroy()
+                    messagebox.showerror('Error', f'Impossibile modificare la cella: {e}')
+                    return
+                self.totals.remove_row(old_row)
+                self.totals.add_row(self.results_model.row(index))
+                self.search_index.update(index, RESULT_KEYS[col_idx], entry.get())
                 entry.destroy()
-                # If the edited column is 'Quantity', update the total
-                if columns[col_idx] == 'Quantity':
-                    self._update_total_label()
+                self.result_tree.refresh_row(pos)
+                self._update_total_label()
             entry.bind('<Return>', save_edit)
             entry.bind('<FocusOut>', save_edit)
         self.result_tree.bind('<Double-1>', on_double_click)
@@ -403,49 +679,79 @@ class PriceCompareApp:
         self.search_column_var.set('Description')
         self.search_column_menu = ttk.Combobox(self.search_frame, textvariable=self.search_column_var, values=['Description', 'Item'], state='readonly', width=12)
         self.search_column_menu.pack(side=tk.LEFT, padx=5)
-        def on_search(*args):
-            term = self.search_var.get().lower()
-            col = self.search_column_var.get().lower()
-            # Instead of filtering, just select the first matching row
-            for row_id in self.result_tree.get_children():
-                values = self.result_tree.item(row_id)['values']
-                if col == 'description':
-                    cell = str(values[1]).lower()
-                else:
-                    cell = str(values[0]).lower()
-                if term in cell:
-                    self.result_tree.selection_set(row_id)
-                    self.result_tree.see(row_id)
-                    break
-            else:
-                self.result_tree.selection_remove(self.result_tree.selection())
-        self.search_var.trace_add('write', lambda *args: on_search())
-        self.search_column_var.trace_add('write', lambda *args: on_search())
+        self.filter_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.search_frame, text='Mostra solo corrispondenze', variable=self.filter_var,
+                        command=self._on_search).pack(side=tk.LEFT, padx=5)
+        ttk.Button(self.search_frame, text='<', width=3, command=lambda: self._goto_match(-1)).pack(side=tk.LEFT)
+        ttk.Button(self.search_frame, text='>', width=3, command=lambda: self._goto_match(1)).pack(side=tk.LEFT)
+        self.match_label = ttk.Label(self.search_frame, text='')
+        self.match_label.pack(side=tk.LEFT, padx=5)
+        self.search_entry.bind('<Return>', lambda e: self._goto_match(1))
+        self.search_entry.bind('<Shift-Return>', lambda e: self._goto_match(-1))
+        self.search_index = search_index if search_index is not None else ResultsSearchIndex(results)
+        self._matches = None
+        self._match_pos = 0
+        self.search_var.trace_add('write', lambda *args: self._on_search())
+        self.search_column_var.trace_add('write', lambda *args: self._on_search())
 
         # Add total label below the search frame
         self.total_var = tk.StringVar()
         self.total_label = ttk.Label(self.root, textvariable=self.total_var, font=('Arial', 12, 'bold'))
         self.total_label.pack(pady=(0, 10))
+        self.totals = RunningTotals.from_model(results)
         self._update_total_label()
 
     def _populate_result_tree(self, results):
-        # Helper to clear and repopulate the result_tree
-        for row in self.result_tree.get_children():
-            self.result_tree.delete(row)
-        for idx, r in enumerate(results):
-            tag = 'evenrow' if idx % 2 == 0 else 'oddrow'
-            self.result_tree.insert('', 'end', values=[
-                r['item'],
-                r['description'],
-                r['price'],
-                r.get('quantity', ''),
-                r['file'].split('/')[-1] if 'file' in r else ''
-            ], tags=(tag,))
+        # Helper to point the result_tree at a new results model
+        self.results_model = results
+        self._view_rows = None
+        self.result_tree.set_row_count(len(results))
+
+    def _model_index(self, pos):
+        # Row position in the table -> row in self.results_model (they differ when filtering)
+        return pos if self._view_rows is None else int(self._view_rows[pos])
+
+    def _on_search(self):
+        term = self.search_var.get()
+        key = 'description' if self.search_column_var.get().lower() == 'description' else 'item'
+        self._matches = self.search_index.search(term, key) if term else None
+        self._match_pos = 0
+        view_rows = self._matches if self.filter_var.get() and self._matches is not None else None
+        if view_rows is not None or self._view_rows is not None:
+            self._view_rows = view_rows
+            self.result_tree.selected_index = None
+            self.result_tree.set_row_count(len(self.results_model) if view_rows is None else len(view_rows))
+        self._show_match()
+
+    def _goto_match(self, step):
+        if self._matches is not None and len(self._matches):
+            self._match_pos = (self._match_pos + step) % len(self._matches)
+            self._show_match()
+
+    def _show_match(self):
+        if self._matches is None:
+            # Empty search: like before, select the first row
+            self.match_label.config(text='')
+            self.result_tree.select_index(0 if len(self.results_model) else None)
+            return
+        if not len(self._matches):
+            self.match_label.config(text='Nessuna corrispondenza')
+            self.result_tree.select_index(None)
+            return
+        self.match_label.config(text=f'{self._match_pos + 1}/{len(self._matches)}')
+        if self._view_rows is not None:
+            self.result_tree.select_index(self._match_pos)
+        else:
+            self.result_tree.select_index(int(self._matches[self._match_pos]))
+
+    def _result_row(self, pos):
+        # Row provider for the VirtualTreeview
+        tag = 'evenrow' if pos % 2 == 0 else 'oddrow'
+        return self.results_model.values(self._model_index(pos)), (tag,)
 
     def save_results(self):
-        import csv
         from tkinter import filedialog
-        if not hasattr(self, 'result_tree') or not self.result_tree.get_children():
+        if not getattr(self, 'results_model', None):
             messagebox.showwarning('Warning', 'Nessun risultato da salvare.')
             return
         # Let user select destination folder
@@ -455,75 +761,19 @@ class PriceCompareApp:
         sep = self.config.get('csv_separator', ',')
         dec_sep = self.config.get('decimal_separator', '.')
         thou_sep = self.config.get('thousands_separator', ',')
-        # Gather current data from the Treeview
-        tree_data = []
-        for row_id in self.result_tree.get_children():
-            values = self.result_tree.item(row_id)['values']
-            # Ensure we have all columns (Item, Description, Lowest Price, Quantity, Source File)
-            if len(values) < 5:
-                values += [''] * (5 - len(values))
-            # # Format price according to config
-            # price = values[2]
-            # try:
-            #     price_float = float(str(price).replace(thou_sep, '').replace(dec_sep, '.'))
-            #     price_str = f"{price_float:,.4f}".replace(',', 'X').replace('.', dec_sep).replace('X', thou_sep)
-            # except Exception:
-            #     price_str = str(price)
-            tree_data.append({
-                'item': values[0],
-                'description': values[1],
-                'price': values[2],
-                'quantity': values[3],
-                'file': values[4],
-            })
-        # Group results by source file
-        results_by_file = {}
-        for r in tree_data:
-            source_file = r['file']
-            if source_file not in results_by_file:
-                results_by_file[source_file] = []
-            results_by_file[source_file].append(r)
-        try:
-            with open(os.path.join(folder_path, 'result_compared.csv'), 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f, delimiter=sep)
-                writer.writerow(['Item', 'Description', LOWEST_PRICE_LABEL, 'Quantity', SOURCE_FILE_LABEL])
-                for r in tree_data:
-                    if str(r['quantity']).strip() and str(r['quantity']).strip() != '0':
-                        price = r['price']
-                        try:
-                            # price_float = float(str(price).replace(thou_sep, '').replace(dec_sep, '.'))
-                            price_str = f"{price}".replace(',', 'X').replace('.', dec_sep).replace('X', thou_sep)
-                        except Exception:
-                            price_str = str(price)
-                        writer.writerow([r['item'], r['description'], price_str, r['quantity'], r['file']])
-        except Exception as e:
-            messagebox.showerror('Error', f'Failed to save combined CSV: {e}')
-        # Save one CSV per source Excel file
-        for source_file, rows in results_by_file.items():
-            base_name = os.path.splitext(os.path.basename(source_file))[0]
-            csv_name = f"{base_name}_compared.csv"
-            csv_path = os.path.join(folder_path, csv_name)
-            try:
-                with open(csv_path, 'w', newline='', encoding='utf-8') as f:
-                    writer = csv.writer(f, delimiter=sep)
-                    writer.writerow(['Item', 'Description', LOWEST_PRICE_LABEL, 'Quantity'])
-                    for r in rows:
-                        if str(r['quantity']).strip() and str(r['quantity']).strip() != '0':
-                            price = r['price']
-                            try:
-                                # price_float = float(str(price).replace(thou_sep, '').replace(dec_sep, '.'))
-                                price_str = f"{price}".replace(',', 'X').replace('.', dec_sep).replace('X', thou_sep)
-                            except Exception:
-                                price_str = str(price)
-                            writer.writerow([r['item'], r['description'], price_str, r['quantity']])
-            except Exception as e:
-                messagebox.showerror('Error', f'Failed to save CSV for {source_file}: {e}')
+        # The rows come straight from the results model, not from the Treeview
+        first = len(self.metrics.records)
+        with measure(self.metrics, 'export', len(self.results_model)):
+            save_compared_csvs(
+                folder_path, self.results_model.to_frame(), sep, dec_sep, thou_sep,
+                on_error=lambda path, e: messagebox.showerror('Error', f'Failed to save {os.path.basename(path)}: {e}')
+            )
+        self._show_stages(first)
         messagebox.showinfo('Success', f'CSV files saved to {folder_path}')
 
     def save_temporary_results(self):
-        import csv
         from tkinter import filedialog
-        if not hasattr(self, 'result_tree') or not self.result_tree.get_children():
+        if not getattr(self, 'results_model', None):
             messagebox.showwarning('Warning', 'Nessun risultato da salvare.')
             return
         file_path = filedialog.asksaveasfilename(defaultextension='.csv', filetypes=[('CSV Files', '*.csv')], title='Salva i risultati temporanei come')
@@ -532,39 +782,14 @@ class PriceCompareApp:
         sep = self.config.get('csv_separator', ',')
         dec_sep = self.config.get('decimal_separator', '.')
         thou_sep = self.config.get('thousands_separator', ',')
-        # Gather current data from the Treeview
-        tree_data = []
-        for row_id in self.result_tree.get_children():
-            values = self.result_tree.item(row_id)['values']
-            # Ensure we have all columns (Item, Description, Lowest Price, Quantity, Source File)
-            if len(values) < 5:
-                values += [''] * (5 - len(values))
-            # Format price according to config
-            price = values[2]
-            try:
-                # price_float = float(str(price).replace(thou_sep, '').replace(dec_sep, '.'))
-                price_str = f"{price}".replace(',', 'X').replace('.', dec_sep).replace('X', thou_sep)
-            except Exception:
-                price_str = str(price)
-            tree_data.append({
-                'item': values[0],
-                'description': values[1],
-                'price': price_str,
-                'quantity': values[3],
-                'file': values[4],
-            })
         try:
-            with open(file_path, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f, delimiter=sep)
-                writer.writerow(['Item', 'Description', LOWEST_PRICE_LABEL, 'Quantity', SOURCE_FILE_LABEL])
-                for r in tree_data:
-                    writer.writerow([r['item'], r['description'], r['price'], r['quantity'], r['file']])
+            with measure(self.metrics, 'export_temp', len(self.results_model)):
+                save_temporary_csv(file_path, self.results_model.to_frame(), sep, dec_sep, thou_sep)
             messagebox.showinfo('Success', f'Temporary results saved to {file_path}')
         except Exception as e:
             messagebox.showerror('Error', f'Failed to save temporary results: {e}')
 
     def load_results_from_csv(self):
-        import pandas as pd
         from tkinter import filedialog
         file_path = filedialog.askopenfilename(filetypes=[('CSV Files', '*.csv')], title='Carica i risultati da CSV')
         if not file_path:
@@ -572,40 +797,298 @@ class PriceCompareApp:
         sep = self.config.get('csv_separator', ',')
         dec_sep = self.config.get('decimal_separator', '.')
         thou_sep = self.config.get('thousands_separator', ',')
+        first = len(self.metrics.records)
         try:
-            df = pd.read_csv(file_path, delimiter=sep, dtype=str)
-            # Ensure columns are in the expected order and format
-            if 'Item' in df.columns and 'Description' in df.columns and LOWEST_PRICE_LABEL in df.columns:
-                # Parse price column to string formatted according to config
-                def format_price(val):
-                    if pd.isna(val) or str(val).strip() == '':
-                        return ''
-                    try:
-                        return  float(str(val).replace(thou_sep, '').replace(dec_sep, '.'))
-                        # return f"{price_float:,.4f}".replace(',', 'X').replace('.', dec_sep).replace('X', thou_sep)
-                    except Exception:
-                        return str(val)
-                df['Lowest Price'] = df[LOWEST_PRICE_LABEL].apply(format_price)
-                # Rename columns to match display_results expectations
-                df = df.rename(columns={
-                    'Item': 'item',
-                    'Description': 'description',
-                    LOWEST_PRICE_LABEL: 'price',
-                    'Quantity': 'quantity',
-                    SOURCE_FILE_LABEL: 'file'
-                })
-                # Ensure quantity is empty string if null/empty/NaN
-                import numpy as np
-                df['quantity'] = df['quantity'].apply(lambda x: '' if pd.isna(x) or str(x).strip().lower() in ('', 'nan') else x)
-                self.display_results(df.to_dict('records'))
-                messagebox.showinfo('Success', f'Results loaded from {file_path}')
-                # Enable menu items for saving
-                self.file_menu.entryconfig(CSV_MENU_LABEL, state='normal')
-                self.file_menu.entryconfig(TEMP_MENU_LABEL, state='normal')
-            else:
-                messagebox.showwarning('Warning', f'CSV file does not contain expected columns (Item, Description, {LOWEST_PRICE_LABEL}).')
+            # Parsed column-wise and handed to the results model as columns, no dict per row
+            with measure(self.metrics, 'reload') as record:
+                results = ResultsModel.from_frame(load_results_csv(file_path, sep, dec_sep, thou_sep))
+                record['rows'] = len(results)
+        except ValueError as e:
+            messagebox.showwarning('Warning', str(e))
+            return
         except Exception as e:
             messagebox.showerror('Error', f'Impossibile caricare i risultati da CSV: {e}')
+            return
+        with measure(self.metrics, 'display', len(results)):
+            self.display_results(results)
+        self._show_stages(first)
+        messagebox.showinfo('Success', f'Results loaded from {file_path}')
+        # Enable menu items for saving
+        self.file_menu.entryconfig(CSV_MENU_LABEL, state='normal')
+        self.file_menu.entryconfig(TEMP_MENU_LABEL, state='normal')
+
+    def show_price_matrix(self):
+        # Every supplier's price per item, from the lists in memory (not from a loaded CSV)
+        if not len(self.comparison):
+            messagebox.showwarning('Warning', 'Nessun listino confrontato.')
+            return
+        matrix = self.comparison.price_matrix_frame()
+        columns = [MATRIX_LABELS.get(c, c) for c in matrix.columns]
+        cells = [matrix[c].to_numpy(dtype=object) for c in matrix.columns]
+        def matrix_row(index):
+            values = ['' if isinstance(v, float) and v != v else v for v in (column[index] for column in cells)]
+            return values, ('evenrow' if index % 2 == 0 else 'oddrow',)
+        window = tk.Toplevel(self.root)
+        window.title(f'Matrice prezzi - {len(matrix):,} articoli, {len(columns) - 6} listini')
+        frame = ttk.Frame(window)
+        frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        tree = VirtualTreeview(frame, matrix_row, columns=columns, show='headings', height=20)
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=110, anchor='center', stretch=True)
+        tree.tag_configure('evenrow', background='#f2f2f2')
+        tree.tag_configure('oddrow', background='#ffffff')
+        scroll_y = ttk.Scrollbar(frame, orient='vertical')
+        scroll_x = ttk.Scrollbar(frame, orient='horizontal', command=tree.xview)
+        tree.attach_yscrollbar(scroll_y)
+        tree.configure(xscrollcommand=scroll_x.set)
+        tree.grid(row=0, column=0, sticky='nsew')
+        scroll_y.grid(row=0, column=1, sticky='ns')
+        scroll_x.grid(row=1, column=0, sticky='ew')
+        frame.rowconfigure(0, weight=1)
+        frame.columnconfigure(0, weight=1)
+        tree.set_row_count(len(matrix))
+        def export():
+            file_path = filedialog.asksaveasfilename(parent=window, defaultextension='.csv', initialfile=MATRIX_CSV_NAME,
+                                                     filetypes=[('CSV Files', '*.csv')], title='Salva la matrice prezzi come')
+            if not file_path:
+                return
+            try:
+                save_price_matrix_csv(file_path, matrix, self.config.get('csv_separator', ','),
+                                      self.config.get('decimal_separator', '.'), self.config.get('thousands_separator', ','))
+                messagebox.showinfo('Success', f'Price matrix saved to {file_path}', parent=window)
+            except Exception as e:
+                messagebox.showerror('Error', f'Failed to save the price matrix: {e}', parent=window)
+        ttk.Button(window, text='Esporta CSV', command=export).pack(pady=5)
+
+    def show_description_matches(self):
+        # Proposed matches between items coded differently; nothing changes until they are confirmed and applied
+        if len(self.comparison) < 2:
+            messagebox.showwarning('Warning', 'Servono almeno due listini confrontati.')
+            return
+        if self._refuse_if_busy():
+            return
+        # Matched in a worker thread like the comparison; the comparison stays unchanged (busy) meanwhile
+        first = len(self.metrics.records)
+        self._set_busy(True)
+        self.root.config(cursor='watch')
+        self.status_var.set('Ricerca abbinamenti per descrizione...')
+        best, supplier_prices = self.comparison.best, self.comparison.supplier_prices
+        threshold = self.config.get('description_match_threshold', MATCH_THRESHOLD)
+        rejected = set(self.match_decisions.rejected)
+        def match_in_background():
+            try:
+                with measure(self.metrics, 'description_match', len(best)):
+                    matches = find_description_matches(best, supplier_prices, threshold, rejected=rejected)
+            except Exception as e:
+                self.root.after(0, self._on_description_matches_done, None, first, e)
+                return
+            self.root.after(0, self._on_description_matches_done, matches, first, None)
+        threading.Thread(target=match_in_background, daemon=True).start()
+
+    def _on_description_matches_done(self, matches, first, error):
+        self.root.config(cursor='')
+        self._set_busy(False)
+        self._show_stages(first)
+        if error is not None:
+            messagebox.showerror('Error', f'Ricerca abbinamenti non riuscita: {error}')
+            return
+        # The confirmed matches come first, so they can be rejected again
+        confirmed = list(self.match_decisions.confirmed.values())
+        pairs = [(m['key_a'], m['key_b']) for m in confirmed] + list(zip(matches['key_a'], matches['key_b']))
+        similarity = [m.get('similarity') for m in confirmed] + matches['similarity'].tolist()
+        cells = [[m['similarity'], '', m['key_a'], '', m['key_b'], ''] for m in confirmed]
+        columns = ['similarity', 'group_confidence', 'item_a', 'description_a', 'item_b', 'description_b']
+        matrix = [matches[c].to_numpy(dtype=object) for c in columns]
+        state = ['confermato'] * len(confirmed) + [''] * len(matches)
+        def match_row(index):
+            if index < len(confirmed):
+                values = cells[index]
+            else:
+                values = [column[index - len(confirmed)] for column in matrix]
+            values = ['' if v is None or (isinstance(v, float) and v != v) else v for v in values] + [state[index]]
+            return values, ('evenrow' if index % 2 == 0 else 'oddrow',)
+        window = tk.Toplevel(self.root)
+        window.title(f'Abbinamenti per descrizione - {len(matches):,} proposti, {len(confirmed):,} confermati')
+        frame = ttk.Frame(window)
+        frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        headings = ['Somiglianza', 'Gruppo', 'Articolo A', 'Descrizione A', 'Articolo B', 'Descrizione B', 'Stato']
+        tree = VirtualTreeview(frame, match_row, columns=headings, show='headings', height=20)
+        for col in headings:
+            tree.heading(col, text=col)
+            tree.column(col, width=250 if col.startswith('Descrizione') else 90, anchor='center', stretch=True)
+        tree.tag_configure('evenrow', background='#f2f2f2')
+        tree.tag_configure('oddrow', background='#ffffff')
+        scroll_y = ttk.Scrollbar(frame, orient='vertical')
+        tree.attach_yscrollbar(scroll_y)
+        tree.grid(row=0, column=0, sticky='nsew')
+        scroll_y.grid(row=0, column=1, sticky='ns')
+        frame.rowconfigure(0, weight=1)
+        frame.columnconfigure(0, weight=1)
+        tree.set_row_count(len(pairs))
+        def set_state(value):
+            index = tree.selected_index
+            if index is None:
+                return
+            state[index] = value
+            tree.refresh_row(index)
+            if index + 1 < len(pairs):
+                tree.select_index(index + 1)
+        def confirm_above():
+            # Whole groups whose weakest link is at least the chosen similarity
+            try:
+                limit = float(limit_var.get())
+            except ValueError:
+                return
+            for i, confidence in enumerate(matches['group_confidence'].tolist()):
+                if confidence >= limit and not state[len(confirmed) + i]:
+                    state[len(confirmed) + i] = 'confermato'
+            tree.refresh()
+        def apply():
+            if self._refuse_if_busy(window):
+                return
+            for index, value in enumerate(state):
+                key_a, key_b = pairs[index]
+                if value == 'confermato' and index >= len(confirmed):
+                    self.match_decisions.confirm(key_a, key_b, similarity[index])
+                elif value == 'rifiutato':
+                    self.match_decisions.reject(key_a, key_b)
+            try:
+                self.match_decisions.save()
+            except OSError as e:
+                messagebox.showerror('Error', f'Impossibile salvare gli abbinamenti: {e}', parent=window)
+            self.comparison.set_item_aliases(self.match_decisions.aliases())
+            window.destroy()
+            self.compare_and_display()
+        buttons = ttk.Frame(window)
+        buttons.pack(pady=5)
+        ttk.Button(buttons, text='Conferma', command=lambda: set_state('confermato')).pack(side=tk.LEFT, padx=2)
+        ttk.Button(buttons, text='Rifiuta', command=lambda: set_state('rifiutato')).pack(side=tk.LEFT, padx=2)
+        limit_var = tk.StringVar(value='0.95')
+        ttk.Button(buttons, text='Conferma gruppi con somiglianza almeno', command=confirm_above).pack(side=tk.LEFT, padx=2)
+        ttk.Spinbox(buttons, from_=0.5, to=1.0, increment=0.05, textvariable=limit_var, width=5).pack(side=tk.LEFT)
+        ttk.Button(buttons, text='Applica al confronto', command=apply).pack(side=tk.LEFT, padx=10)
+        tree.bind('<Return>', lambda e: set_state('confermato'))
+        tree.bind('<Delete>', lambda e: set_state('rifiutato'))
+
+    def show_price_history(self):
+        if self.history is None:
+            messagebox.showinfo('Info', 'Lo storico prezzi è disattivato (price_history in config.json).')
+            return
+        window = tk.Toplevel(self.root)
+        window.title('Storico prezzi')
+        form = ttk.Frame(window)
+        form.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Label(form, text='Codice articolo/EAN:').grid(row=0, column=0, sticky='w')
+        item_var = tk.StringVar()
+        ttk.Entry(form, textvariable=item_var, width=20).grid(row=0, column=1, padx=2)
+        ttk.Label(form, text='Fornitore:').grid(row=0, column=2, sticky='w')
+        supplier_var = tk.StringVar()
+        ttk.Combobox(form, textvariable=supplier_var, values=[''] + self.history.suppliers(), width=20).grid(row=0, column=3, padx=2)
+        ttk.Label(form, text='Dal (AAAA-MM-GG):').grid(row=1, column=0, sticky='w')
+        since_var = tk.StringVar()
+        ttk.Entry(form, textvariable=since_var, width=20).grid(row=1, column=1, padx=2)
+        ttk.Label(form, text='Al:').grid(row=1, column=2, sticky='w')
+        until_var = tk.StringVar()
+        ttk.Entry(form, textvariable=until_var, width=20).grid(row=1, column=3, padx=2)
+        frame = ttk.Frame(window)
+        frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        shown = {'frame': pd.DataFrame()}
+        def table_row(index):
+            values = [shown['cells'][c][index] for c in range(len(shown['cells']))]
+            values = ['' if v is None or (isinstance(v, float) and v != v) else v for v in values]
+            return values, ('evenrow' if index % 2 == 0 else 'oddrow',)
+        tree = VirtualTreeview(frame, table_row, show='headings', height=20)
+        tree.tag_configure('evenrow', background='#f2f2f2')
+        tree.tag_configure('oddrow', background='#ffffff')
+        scroll_y = ttk.Scrollbar(frame, orient='vertical')
+        tree.attach_yscrollbar(scroll_y)
+        tree.grid(row=0, column=0, sticky='nsew')
+        scroll_y.grid(row=0, column=1, sticky='ns')
+        frame.rowconfigure(0, weight=1)
+        frame.columnconfigure(0, weight=1)
+        def show(frame_result):
+            shown['frame'] = frame_result
+            shown['cells'] = [frame_result[c].to_numpy(dtype=object) for c in frame_result.columns]
+            tree.configure(columns=list(frame_result.columns))
+            for col in frame_result.columns:
+                tree.heading(col, text=col)
+                tree.column(col, width=200 if col == 'description' else 110, anchor='center', stretch=True)
+            tree.set_row_count(len(frame_result))
+            window.title(f'Storico prezzi - {len(frame_result):,} righe')
+        def run(query):
+            try:
+                show(query())
+            except Exception as e:
+                messagebox.showerror('Error', f'Ricerca nello storico non riuscita: {e}', parent=window)
+        def search_item():
+            if not item_var.get().strip():
+                messagebox.showwarning('Warning', 'Indicare un codice articolo.', parent=window)
+                return
+            run(lambda: self.history.price_history(item_var.get().strip(), supplier_var.get() or None,
+                                                   since_var.get().strip() or None, until_var.get().strip() or None))
+        def show_changes():
+            if not since_var.get().strip():
+                messagebox.showwarning('Warning', 'Indicare la data da cui cercare le variazioni.', parent=window)
+                return
+            run(lambda: self.history.price_changes(since_var.get().strip(), until_var.get().strip() or None))
+        def compare_at():
+            # The comparison of the lists in force at the date, straight from the store
+            if self._refuse_if_busy(window):
+                return
+            try:
+                best = self.history.best_prices(until_var.get().strip() or None)
+            except Exception as e:
+                messagebox.showerror('Error', f'Ricerca nello storico non riuscita: {e}', parent=window)
+                return
+            self._first_stage = len(self.metrics.records)
+            self._show_comparison_results(ResultsModel.from_frame(best))
+        def export():
+            file_path = filedialog.asksaveasfilename(parent=window, defaultextension='.csv',
+                                                     filetypes=[('CSV Files', '*.csv')], title='Salva come')
+            if not file_path:
+                return
+            try:
+                shown['frame'].to_csv(file_path, index=False, sep=self.config.get('csv_separator', ','),
+                                      decimal=self.config.get('decimal_separator', '.'))
+            except Exception as e:
+                messagebox.showerror('Error', f'Failed to save {file_path}: {e}', parent=window)
+        buttons = ttk.Frame(window)
+        buttons.pack(pady=5)
+        ttk.Button(buttons, text='Storico articolo', command=search_item).pack(side=tk.LEFT, padx=2)
+        ttk.Button(buttons, text='Variazioni prezzi', command=show_changes).pack(side=tk.LEFT, padx=2)
+        ttk.Button(buttons, text='Confronto alla data', command=compare_at).pack(side=tk.LEFT, padx=2)
+        ttk.Button(buttons, text='Importazioni', command=lambda: run(self.history.imports)).pack(side=tk.LEFT, padx=2)
+        ttk.Button(buttons, text='Esporta CSV', command=export).pack(side=tk.LEFT, padx=10)
+
+    def _show_stages(self, first):
+        # Status bar: the stages recorded since record number first
+        self.status_var.set(self.metrics.describe(self.metrics.records[first:]))
+
+    def show_diagnostics(self):
+        dialog = tk.Toplevel(self.root)
+        dialog.title('Diagnostica prestazioni')
+        columns = ['Fase', 'Secondi', 'Righe', 'Picco MB', 'Memoria finale MB', 'Ora', 'Errore']
+        tree = ttk.Treeview(dialog, columns=columns, show='headings', height=15)
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=90 if col != 'Errore' else 200, anchor='center')
+        for record in self.metrics.records:
+            rows, peak, memory = (record.get(key) for key in ('rows', 'peak_mb', 'memory_mb'))
+            tree.insert('', 'end', values=[
+                STAGE_LABELS.get(record['stage'], record['stage']), f"{record['seconds']:.3f}",
+                '' if rows is None else f'{rows:,}', '' if peak is None else f'{peak:,.0f}',
+                '' if memory is None else f'{memory:,.0f}', record['time'][11:], record.get('error', '')])
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        log_var = tk.BooleanVar(value=bool(self.config.get('metrics_log')))
+        def on_toggle_log():
+            # Saved in config.json, applies from the next stage on
+            self.config['metrics_log'] = log_var.get()
+            self.save_config()
+            self.metrics.log_file = StageMetrics.from_config(self.config).log_file
+        ttk.Checkbutton(dialog, text='Registra le fasi su file (JSON lines)', variable=log_var,
+                        command=on_toggle_log).pack(pady=2)
+        ttk.Button(dialog, text='Chiudi', command=dialog.destroy).pack(pady=5)
 
     def open_config_dialog(self):
         dialog = tk.Toplevel(self.root)
@@ -639,24 +1122,8 @@ class PriceCompareApp:
         dialog.wait_window()
 
     def _update_total_label(self):
-        # Calculate the total (prezzo*quantità) grouped by listino (source file)
-        totals = {}
-        for row_id in self.result_tree.get_children():
-            values = self.result_tree.item(row_id)['values']
-            try:
-                prezzo = float(str(values[2]).replace(',', '.').replace(' ', ''))
-                quantita = float(str(values[3]).replace(',', '.').replace(' ', '')) if str(values[3]).strip() else 0.0
-                listino = str(values[4]) if len(values) > 4 else 'Listino sconosciuto'
-                if listino not in totals:
-                    totals[listino] = 0.0
-                totals[listino] += prezzo * quantita
-            except Exception:
-                continue
-        if totals:
-            lines = [f"Totale per {listino}: {tot:,.2f}" for listino, tot in totals.items()]
-            self.total_var.set("\n".join(lines))
-        else:
-            self.total_var.set("")
+        # Show the running totals (prezzo*quantità, righe, sconto medio) grouped by listino (source file)
+        self.total_var.set("\n".join(self.totals.lines()))
 
 if __name__ == '__main__':
     root = tk.Tk()
@@ -0,0 +1,319 @@
+"""
+Price history: every normalized price list is stored as an import of its
+supplier, with a timestamp, in an SQLite file, so past prices are queried
+instead of re-opening old workbooks or CSVs.
+
+    python price_history.py item 8001234567890 --supplier acme --at 2026-09-30
+    python price_history.py changes --since 2026-09-01 --output changes.csv
+    python price_history.py best --at 2026-09-30 --output best.csv
+
+Lists are ingested by the GUI and by price_compare_cli.py --history; a list
+whose content and mapping did not change since the supplier's last import is
+not stored again.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from price_compare_engine import PRICE_FORMAT_KEYS, normalize_item_column
+from price_list_cache import content_digest
+
+DEFAULT_HISTORY_FILE = 'price_history.sqlite'
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS imports (
+    id INTEGER PRIMARY KEY,
+    supplier TEXT NOT NULL,
+    file TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    mapping TEXT NOT NULL,
+    imported_at TEXT NOT NULL,
+    rows INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS imports_supplier_date ON imports (supplier, imported_at);
+CREATE INDEX IF NOT EXISTS imports_file ON imports (file);
+-- supplier and imported_at are repeated on every price so each lookup is one index range
+CREATE TABLE IF NOT EXISTS prices (
+    import_id INTEGER NOT NULL REFERENCES imports (id) ON DELETE CASCADE,
+    supplier TEXT NOT NULL,
+    imported_at TEXT NOT NULL,
+    item_key TEXT NOT NULL,
+    item TEXT,
+    description TEXT,
+    price REAL
+);
+CREATE INDEX IF NOT EXISTS prices_item_supplier_date ON prices (item_key, supplier, imported_at);
+CREATE INDEX IF NOT EXISTS prices_import_item ON prices (import_id, item_key);
+"""
+# The latest import of every supplier at or before a date; of imports in the same second the last one stored
+LATEST_IMPORTS = """
+SELECT id, supplier, imported_at FROM (
+    SELECT id, supplier, imported_at,
+           ROW_NUMBER() OVER (PARTITION BY supplier ORDER BY imported_at DESC, id DESC) AS rank
+    FROM imports WHERE imported_at <= ?
+) WHERE rank = 1
+"""
+BEST_PRICES = f"""
+WITH latest AS ({LATEST_IMPORTS}),
+current AS (
+    SELECT p.item_key, p.item, p.description, p.price, p.supplier FROM prices p
+    JOIN latest l ON p.import_id = l.id
+),
+-- Unreadable prices (NULL) last, like the comparison
+ranked AS (
+    SELECT *, ROW_NUMBER() OVER (PARTITION BY item_key ORDER BY price IS NULL, price, supplier) AS rank,
+           LEAD(price) OVER (PARTITION BY item_key ORDER BY price IS NULL, price, supplier) AS second_price
+    FROM current
+)
+SELECT item, price, description, supplier AS file, second_price FROM ranked WHERE rank = 1
+ORDER BY LOWER(description), item_key
+"""
+PRICE_CHANGES = f"""
+WITH before AS ({LATEST_IMPORTS}), after AS ({LATEST_IMPORTS})
+SELECT n.supplier, n.item_key, n.item, n.description, o.price AS old_price, n.price AS new_price,
+       n.price - o.price AS change, ROUND(100.0 * (n.price - o.price) / o.price, 2) AS change_pct,
+       o.imported_at AS old_date, n.imported_at AS new_date
+FROM after a
+JOIN before b ON b.supplier = a.supplier AND b.imported_at < a.imported_at
+JOIN prices n ON n.import_id = a.id
+JOIN prices o ON o.import_id = b.id AND o.item_key = n.item_key
+WHERE n.price IS NOT NULL AND o.price IS NOT NULL AND n.price <> o.price
+ORDER BY ABS(n.price - o.price) / o.price DESC, n.supplier, n.item_key
+"""
+
+
+def supplier_of(file):
+    """Supplier name of a price list: its file name without the extension."""
+    return os.path.splitext(os.path.basename(file))[0]
+
+
+def item_key_of(item):
+    """The key a code is stored under, normalized like the comparison does ('8001234567890', 'ab-12')."""
+    return str(normalize_item_column(pd.Series([item], dtype=object))[0].iloc[0])
+
+
+def _mapping_text(mapping):
+    keys = ('header_idx', 'item_col', 'price_col', 'description_col') + PRICE_FORMAT_KEYS
+    return json.dumps({key: mapping.get(key) for key in keys}, sort_keys=True)
+
+
+def _end_of(date):
+    # '2026-09-30' covers the whole day
+    return date + 'T23:59:59' if date and len(date) == 10 else (date or '9999')
+
+
+class PriceHistory:
+    """
+    The SQLite store. A connection is opened per call, so one PriceHistory can
+    be used from the GUI's worker threads.
+    """
+
+    def __init__(self, path=DEFAULT_HISTORY_FILE):
+        self.path = path
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    @classmethod
+    def from_config(cls, config):
+        """None unless price_history is on in the config."""
+        if not config.get('price_history'):
+            return None
+        return cls(config.get('price_history_file') or DEFAULT_HISTORY_FILE)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute('PRAGMA foreign_keys = ON')
+        return _Closing(db)
+
+    def is_imported(self, file, mapping, supplier=None):
+        """True if the latest import of the supplier has this file's content and mapping."""
+        return self._check_imported(file, mapping, supplier)[0]
+
+    def _check_imported(self, file, mapping, supplier):
+        # (is_imported, the file's digest if it had to be computed, else None)
+        supplier = supplier or supplier_of(file)
+        stat = os.stat(file)
+        with self._connect() as db:
+            latest = db.execute(
+                'SELECT file, size, mtime_ns, digest, mapping FROM imports WHERE supplier = ? '
+                'ORDER BY imported_at DESC, id DESC LIMIT 1', (supplier,)).fetchone()
+        if latest is None or latest[4] != _mapping_text(mapping):
+            return False, None
+        # Same file untouched: no need to hash it again
+        if latest[:3] == (os.path.abspath(file), stat.st_size, stat.st_mtime_ns):
+            return True, None
+        digest = content_digest(file)
+        return latest[3] == digest, digest
+
+    def ingest(self, file, offers, mapping, supplier=None, imported_at=None):
+        """
+        Store the normalized offers of file as a new import of its supplier,
+        unless is_imported. Returns the import id, or None if skipped.
+        """
+        supplier = supplier or supplier_of(file)
+        imported, digest = self._check_imported(file, mapping, supplier)
+        if imported:
+            return None
+        stat = os.stat(file)
+        imported_at = imported_at or time.strftime('%Y-%m-%dT%H:%M:%S')
+        items = offers['original_item'].map(str).to_numpy(dtype=object)
+        descriptions = offers['description'].to_numpy(dtype=object)
+        descriptions = np.where(pd.isna(descriptions), None, descriptions)
+        prices = offers['price'].to_numpy(dtype=float)
+        rows = zip(offers['item_key'].astype(object).map(str).tolist(), items.tolist(),
+                   [None if d is None else str(d) for d in descriptions.tolist()],
+                   [None if np.isnan(p) else p for p in prices.tolist()])
+        with self._connect() as db:
+            import_id = db.execute(
+                'INSERT INTO imports (supplier, file, size, mtime_ns, digest, mapping, imported_at, rows) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (supplier, os.path.abspath(file), stat.st_size, stat.st_mtime_ns, digest or content_digest(file),
+                 _mapping_text(mapping), imported_at, len(offers))).lastrowid
+            db.executemany(
+                'INSERT INTO prices (import_id, supplier, imported_at, item_key, item, description, price) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((import_id, supplier, imported_at, *row) for row in rows))
+        return import_id
+
+    def ingest_comparison(self, comparison, mappings, on_error=None):
+        """
+        ingest the lists of mappings that are in a PriceComparison (lists that
+        failed are skipped); returns the number of new imports.
+        """
+        imported = 0
+        for mapping in mappings:
+            file = mapping['file']
+            offers = comparison.offers.get(file)
+            if offers is None:
+                continue
+            try:
+                imported += self.ingest(file, offers, mapping) is not None
+            except (OSError, sqlite3.Error) as e:
+                if on_error is None:
+                    raise
+                on_error(file, e)
+        return imported
+
+    def _frame(self, sql, params=()):
+        with self._connect() as db:
+            return pd.read_sql_query(sql, db, params=params)
+
+    def imports(self, supplier=None):
+        """The imports, newest first: id, supplier, file, imported_at, rows."""
+        where, params = ('WHERE supplier = ?', (supplier,)) if supplier else ('', ())
+        return self._frame(f'SELECT id, supplier, file, imported_at, rows FROM imports {where} '
+                           'ORDER BY imported_at DESC, id DESC', params)
+
+    def suppliers(self):
+        with self._connect() as db:
+            return [row[0] for row in db.execute('SELECT DISTINCT supplier FROM imports ORDER BY supplier')]
+
+    def price_history(self, item, supplier=None, since=None, until=None):
+        """Every stored price of an item code: imported_at, supplier, item, description, price."""
+        sql = ('SELECT imported_at, supplier, item, description, price FROM prices '
+               'WHERE item_key = ? AND imported_at >= ? AND imported_at <= ?')
+        params = [item_key_of(item), since or '', _end_of(until)]
+        if supplier:
+            sql += ' AND supplier = ?'
+            params.append(supplier)
+        return self._frame(sql + ' ORDER BY imported_at, supplier', params)
+
+    def price_at(self, item, supplier, date=None):
+        """(price, imported_at) of the supplier's latest import of the item at or before date, or None."""
+        with self._connect() as db:
+            return db.execute(
+                'SELECT price, imported_at FROM prices WHERE item_key = ? AND supplier = ? AND imported_at <= ? '
+                'ORDER BY imported_at DESC, import_id DESC LIMIT 1', (item_key_of(item), supplier, _end_of(date))).fetchone()
+
+    def best_prices(self, date=None):
+        """
+        The cheapest price per item across the suppliers' latest imports at or
+        before date, with the columns of results_frame (file is the supplier).
+        """
+        return self._frame(BEST_PRICES, (_end_of(date),))
+
+    def price_changes(self, since, until=None):
+        """
+        Items whose price differs between each supplier's latest import before
+        since and its latest import up to until.
+        """
+        return self._frame(PRICE_CHANGES, (since, _end_of(until)))
+
+
+class _Closing:
+    # sqlite3's own context manager commits but does not close
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, kind, value, traceback):
+        try:
+            if kind is None:
+                self.db.commit()
+            else:
+                self.db.rollback()
+        finally:
+            self.db.close()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Query the price history.')
+    parser.add_argument('-d', '--database', default=DEFAULT_HISTORY_FILE, help='the SQLite file')
+    parser.add_argument('-o', '--output', help='write the result as CSV instead of printing it')
+    commands = parser.add_subparsers(dest='command', required=True)
+    item = commands.add_parser('item', help='stored prices of an item code')
+    item.add_argument('item')
+    item.add_argument('--supplier')
+    item.add_argument('--since', help='YYYY-MM-DD')
+    item.add_argument('--until', help='YYYY-MM-DD')
+    item.add_argument('--at', help='only the price in force at this date (needs --supplier)')
+    changes = commands.add_parser('changes', help='price changes since a date')
+    changes.add_argument('--since', required=True, help='YYYY-MM-DD')
+    changes.add_argument('--until', help='YYYY-MM-DD (default: now)')
+    best = commands.add_parser('best', help='best price per item at a date')
+    best.add_argument('--at', help='YYYY-MM-DD (default: now)')
+    commands.add_parser('imports', help='list the imports')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.database):
+        print(f'{args.database} not found.', file=sys.stderr)
+        return 2
+    history = PriceHistory(args.database)
+    if args.command == 'item' and args.at:
+        if not args.supplier:
+            print('--at needs --supplier.', file=sys.stderr)
+            return 2
+        found = history.price_at(args.item, args.supplier, args.at)
+        print('Nessun prezzo.' if found is None else f'{found[0]} ({found[1]})')
+        return 0 if found else 1
+    if args.command == 'item':
+        result = history.price_history(args.item, args.supplier, args.since, args.until)
+    elif args.command == 'changes':
+        result = history.price_changes(args.since, args.until)
+    elif args.command == 'best':
+        result = history.best_prices(args.at)
+    else:
+        result = history.imports()
+    if args.output:
+        result.to_csv(args.output, index=False)
+    else:
+        print(result.to_string(index=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import pandas as pd
+
+from price_compare_engine import PRICE_FORMAT_KEYS, file_column
+
+# On-disk cache of parsed price lists, so unchanged workbooks are not parsed
+# again by openpyxl. Entries are pickled DataFrames named after a hash of the
+# file fingerprint (path, size, mtime) and of the column mapping. Tables
+# extracted from PDF pages are cached too, keyed by the PDF content hash, the
+# page and the camelot settings, so an interrupted extraction can resume.
+
+CACHE_VERSION = 6
+CACHE_SUFFIX = '.pkl'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.prices_compare_cache')
+DEFAULT_CACHE_MAX_MB = 500
+DIGEST_BLOCK_BYTES = 1024 * 1024
+EVICT_TO = 0.9  # eviction frees down to this share of the limit, so the next stores do not evict again
+
+
+def file_fingerprint(file):
+    stat = os.stat(file)
+    return [os.path.abspath(file), stat.st_size, stat.st_mtime_ns]
+
+
+def content_digest(file):
+    """sha256 of the file content: a copied or re-downloaded PDF keeps its cached pages."""
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(DIGEST_BLOCK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PriceListCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_mb=DEFAULT_CACHE_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        # Running total of the entry sizes, so a store does not list the directory (None until the first store)
+        self._size = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('cache_dir') or DEFAULT_CACHE_DIR, config.get('cache_max_mb', DEFAULT_CACHE_MAX_MB))
+
+    def _path(self, parts):
+        digest = hashlib.sha1(json.dumps([CACHE_VERSION] + parts, sort_keys=True).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + CACHE_SUFFIX)
+
+    def offers_path(self, mapping):
+        # A mapping to detect (header_idx None) depends on the saved profiles it was given
+        return self._path(['offers'] + file_fingerprint(mapping['file']) + [
+            mapping.get('header_idx'), mapping.get('item_col'), mapping.get('price_col'), mapping.get('description_col')
+        ] + [mapping.get(key) for key in PRICE_FORMAT_KEYS] + ([mapping.get('profiles')] if mapping.get('header_idx') is None else []))
+
+    def preview_path(self, file, nrows):
+        return self._path(['preview', nrows] + file_fingerprint(file))
+
+    def pdf_page_path(self, digest, page, settings):
+        return self._path(['pdf_page', digest, page, sorted(settings.items())])
+
+    def pdf_page_count_path(self, digest):
+        return self._path(['pdf_page_count', digest])
+
+    def _load(self, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            df = pd.read_pickle(path)
+            os.utime(path)  # mark as recently used for eviction
+            return df
+        except Exception:
+            return None
+
+    def _store(self, path, df):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = path + '.tmp'
+            pd.to_pickle(df, tmp_path)
+            replaced = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            if self._size is None:
+                self._size = self.size()
+            else:
+                self._size += os.path.getsize(path) - replaced
+            # The directory is listed again only when the total passes the limit
+            if self._size > self.max_bytes:
+                self.evict()
+        except Exception:
+            pass
+
+    def load_offers(self, mapping):
+        """Cached normalized offers for mapping, or None if missing or stale."""
+        try:
+            offers = self._load(self.offers_path(mapping))
+        except OSError:
+            return None
+        if offers is not None:
+            offers.insert(len(offers.columns) - 1, 'file', file_column(mapping['file'], len(offers)))
+        return offers
+
+    def store_offers(self, mapping, offers):
+        # The file path is part of the key, no need to store it on every row;
+        # nor the normalization time of this read, a cached load has none
+        stored = offers.drop(columns=['file'])
+        stored.attrs = {key: value for key, value in offers.attrs.items()
+                        if key not in ('normalize_seconds', 'normalize_rows')}
+        self._store(self.offers_path(mapping), stored)
+
+    def load_preview(self, file, nrows):
+        try:
+            return self._load(self.preview_path(file, nrows))
+        except OSError:
+            return None
+
+    def store_preview(self, file, nrows, preview_df):
+        self._store(self.preview_path(file, nrows), preview_df)
+
+    def load_pdf_page(self, digest, page, settings):
+        """Cached tables of a PDF page ([] for a page without tables), or None if not extracted yet."""
+        return self._load(self.pdf_page_path(digest, page, settings))
+
+    def store_pdf_page(self, digest, page, settings, tables):
+        self._store(self.pdf_page_path(digest, page, settings), list(tables))
+
+    def load_pdf_page_count(self, digest):
+        return self._load(self.pdf_page_count_path(digest))
+
+    def store_pdf_page_count(self, digest, count):
+        self._store(self.pdf_page_count_path(digest), count)
+
+    def _entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(CACHE_SUFFIX):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in EVICT_TO x max_bytes."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+    def clear(self):
+        """Remove every cache entry and return the number of bytes freed."""
+        freed = 0
+        for _, size, path in self._entries():
+            try:
+                os.remove(path)
+                freed += size
+            except OSError:
+                pass
+        self._size = None
+        return freed
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+from results_totals import parse_number
+
+# Columnar model of the comparison results. The result Treeview, the search,
+# the totals and the exports all read from it; edits are written into it.
+
+RESULT_KEYS = ['item', 'description', 'price', 'quantity', 'file']
+
+
+def _object_array(values):
+    array = np.empty(len(values), dtype=object)
+    array[:] = list(values)
+    return array
+
+
+class ResultsModel:
+    """
+    One array per column: item, description and price as given (a missing
+    price is ''), price_value and second_price as floats (NaN when missing or
+    not a number), quantity as the text typed by the user and the source file
+    as codes into the list of file paths.
+    """
+
+    def __init__(self, item, description, price, file, quantity=None, second_price=None):
+        self.item = _object_array(item)
+        self.description = _object_array(description)
+        self.price = _object_array(price)
+        self.price[pd.isna(self.price)] = ''
+        self.price_value = pd.to_numeric(pd.Series(self.price, dtype=object), errors='coerce').to_numpy(dtype=float, copy=True)
+        # Text prices such as '12,5' are parsed like the totals always did
+        for row in np.flatnonzero(np.isnan(self.price_value) & (self.price != '')):
+            value = parse_number(self.price[row], blank=None)
+            self.price_value[row] = np.nan if value is None else value
+        codes, files = pd.factorize(pd.Series(_object_array(file)).map(str), sort=False)
+        self.file_codes = codes.astype(np.int32)
+        self.files = list(files)
+        # Only the file name is shown and exported, like before
+        self.file_names = [f.split('/')[-1] for f in self.files]
+        if quantity is None:
+            quantity = [''] * len(self.item)
+        self.quantity = _object_array(quantity)
+        if second_price is None:
+            second_price = np.full(len(self.item), np.nan)
+        self.second_price = np.asarray(second_price, dtype=float).copy()
+
+    @classmethod
+    def from_frame(cls, frame):
+        """Build from a frame with item, description, price, file and optionally quantity, second_price."""
+        quantity = None
+        if 'quantity' in frame.columns:
+            quantity = frame['quantity'].where(frame['quantity'].notna(), '').to_numpy(dtype=object)
+        second_price = None
+        if 'second_price' in frame.columns:
+            second_price = pd.to_numeric(frame['second_price'], errors='coerce').to_numpy(dtype=float)
+        return cls(frame['item'].to_numpy(dtype=object), frame['description'].to_numpy(dtype=object),
+                   frame['price'].to_numpy(dtype=object), frame['file'].to_numpy(dtype=object), quantity, second_price)
+
+    @classmethod
+    def from_records(cls, records):
+        return cls.from_frame(pd.DataFrame(list(records), columns=RESULT_KEYS + ['second_price']))
+
+    def __len__(self):
+        return len(self.item)
+
+    def file_name_column(self):
+        return np.asarray(self.file_names, dtype=object)[self.file_codes]
+
+    def column(self, key):
+        if key == 'file':
+            return self.file_name_column()
+        return getattr(self, key)
+
+    def get(self, row, key):
+        if key == 'file':
+            return self.file_names[self.file_codes[row]]
+        if key == 'second_price':
+            value = float(self.second_price[row])
+            return '' if np.isnan(value) else value
+        if key == 'price':
+            # Prices are floats since they are parsed; show 120 rather than 120.0, like the lists
+            value = self.price[row]
+            return int(value) if isinstance(value, float) and value.is_integer() else value
+        return getattr(self, key)[row]
+
+    def values(self, row):
+        """The displayed cells of a row, in RESULT_KEYS order."""
+        return [self.get(row, key) for key in RESULT_KEYS]
+
+    def row(self, row):
+        values = {key: self.get(row, key) for key in RESULT_KEYS}
+        values['second_price'] = self.get(row, 'second_price')
+        return values
+
+    def to_frame(self):
+        """The columns (file names, not paths) as a DataFrame, for the exports."""
+        return pd.DataFrame({
+            'item': self.item,
+            'description': self.description,
+            'price': self.price,
+            'quantity': self.quantity,
+            'file': self.file_name_column(),
+            'second_price': self.second_price,
+        })
+
+    def records(self):
+        for row in range(len(self)):
+            yield self.row(row)
+
+    def set(self, row, key, value):
+        """Write an edited cell. Raises ValueError for a price that is not a number."""
+        if key == 'price':
+            price = parse_number(value, blank=np.nan)
+            if price is None:
+                raise ValueError(f'prezzo non valido: {value!r}')
+            self.price[row] = '' if np.isnan(price) else price
+            self.price_value[row] = price
+        elif key == 'file':
+            if value not in self.file_names:
+                self.files.append(value)
+                self.file_names.append(value)
+            self.file_codes[row] = self.file_names.index(value)
+        else:
+            getattr(self, key)[row] = value
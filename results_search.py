@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+# Search index over the comparison results, built once per comparison.
+
+NGRAM = 3
+SEARCH_KEYS = ('description', 'item')
+BUILD_BATCH = 20000
+
+
+def _gram_codes(texts):
+    """
+    Distinct trigrams of each text as int64 codes (three 21-bit code points),
+    computed on a code point matrix. Returns (text positions, codes).
+    """
+    arr = np.array(texts, dtype=str)
+    width = arr.dtype.itemsize // 4
+    if not len(texts) or width < NGRAM:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    points = arr.view(np.uint32).reshape(len(texts), width).astype(np.int64)
+    codes = (points[:, :-2] << 42) | (points[:, 1:-1] << 21) | points[:, 2:]
+    lengths = np.char.str_len(arr)
+    valid = np.arange(width - NGRAM + 1)[None, :] < (lengths - NGRAM + 1)[:, None]
+    # Sort each row (padding last) so repeated trigrams of a text are adjacent
+    codes = np.sort(np.where(valid, codes, np.iinfo(np.int64).max), axis=1)
+    valid = np.sort(valid, axis=1)[:, ::-1]
+    valid[:, 1:] &= codes[:, 1:] != codes[:, :-1]
+    positions = np.broadcast_to(np.arange(len(texts))[:, None], codes.shape)
+    return positions[valid], codes[valid]
+
+
+class _ColumnIndex:
+    """
+    Trigram index over one lowercased column. Identical values are indexed
+    once: postings hold ids of distinct values, codes map rows to those ids.
+    Postings are slices of one array sorted by gram.
+    """
+
+    def __init__(self, values):
+        codes, uniques = pd.factorize(pd.Series([str(v).lower() for v in values], dtype=object), sort=False)
+        self.codes = codes
+        self.uniques = list(uniques)
+        self.uniques_series = pd.Series(self.uniques, dtype=object)
+        # Batch values of similar length so the code point matrices stay small
+        by_length = np.argsort(self.uniques_series.str.len().to_numpy(), kind='stable')
+        all_ids, all_grams = [], []
+        for start in range(0, len(by_length), BUILD_BATCH):
+            batch = by_length[start:start + BUILD_BATCH]
+            positions, grams = _gram_codes([self.uniques[i] for i in batch])
+            all_ids.append(batch[positions])
+            all_grams.append(grams)
+        value_ids = np.concatenate(all_ids) if all_ids else np.array([], dtype=np.int64)
+        grams = np.concatenate(all_grams) if all_grams else np.array([], dtype=np.int64)
+        order = np.argsort(grams, kind='stable')
+        self.posting_ids = value_ids[order]
+        grams = grams[order]
+        self.gram_keys, self.gram_starts = np.unique(grams, return_index=True)
+        self.gram_ends = np.append(self.gram_starts[1:], len(grams))
+        self.overrides = {}  # row -> lowercased value edited after the index was built
+
+    def _posting(self, gram):
+        i = np.searchsorted(self.gram_keys, gram)
+        if i == len(self.gram_keys) or self.gram_keys[i] != gram:
+            return None
+        return self.posting_ids[self.gram_starts[i]:self.gram_ends[i]]
+
+    def _matching_values(self, term):
+        if len(term) < NGRAM:
+            # Too short for the trigrams: vectorized scan of the distinct values
+            return np.flatnonzero(self.uniques_series.str.contains(term, regex=False).to_numpy(dtype=bool))
+        postings = [self._posting(gram) for gram in np.unique(_gram_codes([term])[1])]
+        if any(ids is None for ids in postings):
+            return np.array([], dtype=np.int64)
+        candidates = None
+        for ids in sorted(postings, key=len):
+            candidates = np.sort(ids) if candidates is None else np.intersect1d(candidates, ids, assume_unique=True)
+            if not len(candidates):
+                return candidates
+        # Trigrams can match out of order: confirm the substring on the candidates
+        return np.array([i for i in candidates if term in self.uniques[i]], dtype=np.int64)
+
+    def search(self, term):
+        rows = np.flatnonzero(np.isin(self.codes, self._matching_values(term)))
+        if self.overrides:
+            edited = np.fromiter(self.overrides, dtype=np.int64)
+            rows = np.setdiff1d(rows, edited, assume_unique=True)
+            hits = [row for row, text in self.overrides.items() if term in text]
+            if hits:
+                rows = np.union1d(rows, np.array(hits, dtype=np.int64))
+        return rows
+
+
+class ResultsSearchIndex:
+    """
+    Case-insensitive substring search over the Description and Item columns of
+    a ResultsModel. search() returns the sorted indexes of all matching rows.
+    """
+
+    def __init__(self, results):
+        self.row_count = len(results)
+        self.columns = {key: _ColumnIndex(results.column(key)) for key in SEARCH_KEYS}
+
+    def search(self, term, key='description'):
+        term = term.lower()
+        if not term:
+            return np.arange(self.row_count)
+        return self.columns[key].search(term)
+
+    def update(self, row, key, value):
+        """Record an edited cell so searches see the new value."""
+        if key in self.columns:
+            self.columns[key].overrides[row] = str(value).lower()
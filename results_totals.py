@@ -0,0 +1,110 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+# Running totals of the result table, per source file (listino). They are
+# updated by the delta of each edited row instead of re-reading every row.
+
+UNKNOWN_SOURCE = 'Listino sconosciuto'
+
+
+def parse_number(value, blank=0.0):
+    """Parse a price/quantity cell; empty cells give blank, unparseable values None."""
+    text = str(value).replace(',', '.').replace(' ', '')
+    if not text.strip() or text.lower() == 'nan':
+        return blank
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+class RunningTotals:
+    """
+    For each listino: total (price * quantity), number of lines with a
+    quantity, and the sums needed for the average discount versus the second
+    best offer (only lines with a second offer count towards the discount).
+    """
+
+    def __init__(self, rows=()):
+        self.reset(rows)
+
+    @classmethod
+    def from_model(cls, model):
+        """Totals of a ResultsModel, computed column-wise instead of row by row."""
+        totals = cls()
+        text = pd.Series(model.quantity, dtype=object).map(str).str.replace(',', '.').str.replace(' ', '')
+        blank = (text.str.strip() == '') | (text.str.lower() == 'nan')
+        quantity = pd.to_numeric(text.where(~blank, '0'), errors='coerce').to_numpy(dtype=float)
+        price = model.price_value
+        # Like _contribution: rows without a price or with an unparseable quantity are skipped
+        valid = ~np.isnan(price) & ~np.isnan(quantity)
+        second = np.where(np.isnan(model.second_price), 0.0, model.second_price)
+        has_second = (quantity != 0) & (second != 0) & np.isfinite(second)
+        codes = model.file_codes[valid]
+        price, quantity, second, has_second = price[valid], quantity[valid], second[valid], has_second[valid]
+        count = len(model.file_names)
+        columns = [
+            np.bincount(codes, weights=price * quantity, minlength=count),
+            np.bincount(codes, weights=quantity != 0, minlength=count),
+            np.bincount(codes, weights=np.where(has_second, price * quantity, 0.0), minlength=count),
+            np.bincount(codes, weights=np.where(has_second, second * quantity, 0.0), minlength=count),
+        ]
+        for code in pd.unique(codes):
+            sums = totals.by_source.setdefault(model.file_names[code], [0.0, 0, 0.0, 0.0])
+            for i, column in enumerate(columns):
+                sums[i] += int(column[code]) if i == 1 else float(column[code])
+        return totals
+
+    def reset(self, rows):
+        self.by_source = {}  # listino -> [total, lines, best_total, second_total]
+        for r in rows:
+            self.add_row(r)
+
+    @staticmethod
+    def _contribution(r):
+        price = parse_number(r.get('price', ''), blank=None)
+        quantity = parse_number(r.get('quantity', ''))
+        if price is None or quantity is None:
+            return None
+        source = str(r['file']).split('/')[-1] if 'file' in r else UNKNOWN_SOURCE
+        second = parse_number(r.get('second_price', ''))
+        has_second = quantity and second and math.isfinite(second)
+        return source, [
+            price * quantity,
+            1 if quantity else 0,
+            price * quantity if has_second else 0.0,
+            second * quantity if has_second else 0.0,
+        ]
+
+    def add_row(self, r, sign=1):
+        contribution = self._contribution(r)
+        if contribution is None:
+            return
+        source, values = contribution
+        sums = self.by_source.setdefault(source, [0.0, 0, 0.0, 0.0])
+        for i, value in enumerate(values):
+            sums[i] += sign * value
+
+    def remove_row(self, r):
+        self.add_row(r, sign=-1)
+
+    def average_discount(self, source):
+        """Percent saved versus the second best offers, or None without any."""
+        _, _, best_total, second_total = self.by_source[source]
+        if second_total <= 1e-9:
+            return None
+        return (1 - best_total / second_total) * 100
+
+    def lines(self):
+        text = []
+        for source, (total, lines, _, _) in self.by_source.items():
+            if abs(total) < 0.005:
+                total = 0.0  # no '-0.00' from the running deltas
+            line = f"Totale per {source}: {total:,.2f} ({lines} righe"
+            discount = self.average_discount(source)
+            if discount is not None:
+                line += f", sconto medio {discount:.1f}% sulla 2a offerta"
+            text.append(line + ')')
+        return text
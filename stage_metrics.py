@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Wall time, rows and peak memory of the stages of a comparison (and of the
+# PDF extraction), shown in the app and optionally appended to a JSON-lines
+# log ('metrics_log' and 'metrics_log_file' in config.json).
+
+DEFAULT_LOG_FILE = 'price_compare_metrics.jsonl'
+SAMPLE_SECONDS = 0.02  # the resident memory is sampled this often while a stage runs
+STAGE_LABELS = {
+    'read': 'lettura listini',
+    'normalize': 'normalizzazione codici e prezzi',
+    'reduce': 'confronto',
+    'results_model': 'modello risultati',
+    'search_index': 'indice ricerca',
+    'display': 'tabella',
+    'export': 'esportazione CSV',
+    'export_temp': 'salvataggio temporaneo',
+    'reload': 'caricamento CSV',
+    'description_match': 'abbinamento descrizioni',
+    'history': 'storico prezzi',
+    'pdf_extract': 'estrazione PDF',
+    'pdf_export': 'esportazione Excel',
+}
+
+
+def _windows_memory_mb():
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+            (name, ctypes.c_size_t) for name in (
+                'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+        return None
+    return counters.WorkingSetSize / (1024 * 1024)
+
+
+def _proc_memory_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def _psutil_memory_mb():
+    import psutil
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+_memory_reader = []  # the first reader that works here, found on the first call
+
+
+def current_memory_mb():
+    """Resident memory of this process now, in MB (None if it cannot be read)."""
+    if not _memory_reader:
+        for reader in (_psutil_memory_mb, _proc_memory_mb, _windows_memory_mb):
+            try:
+                if reader() is not None:
+                    _memory_reader.append(reader)
+                    break
+            except Exception:
+                continue
+        else:
+            _memory_reader.append(lambda: None)
+    try:
+        return _memory_reader[0]()
+    except Exception:
+        return None
+
+
+class _PeakSampler:
+    """
+    Highest resident memory seen while a stage runs, sampled every
+    SAMPLE_SECONDS by a thread (so spikes shorter than that can be missed).
+    """
+
+    def __init__(self):
+        self.peak = current_memory_mb()
+        self._done = threading.Event()
+        self._thread = None
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _sample(self):
+        memory = current_memory_mb()
+        if memory is not None and memory > self.peak:
+            self.peak = memory
+        return memory
+
+    def _run(self):
+        while not self._done.wait(SAMPLE_SECONDS):
+            self._sample()
+
+    def stop(self):
+        """(memory now, peak of the stage), None when the memory cannot be read."""
+        if self._thread is None:
+            return None, None
+        self._done.set()
+        self._thread.join()
+        return self._sample(), self.peak
+
+
+class StageMetrics:
+    """
+    Records of the stages run in this session: stage, seconds, rows,
+    peak_mb (highest resident memory during the stage), memory_mb (at its
+    end), time and error (when the stage raised). With log_file every record
+    is also appended to it as a JSON line.
+    """
+
+    def __init__(self, log_file=None):
+        self.log_file = log_file
+        self.records = []
+
+    @classmethod
+    def from_config(cls, config):
+        if not config.get('metrics_log'):
+            return cls()
+        return cls(config.get('metrics_log_file') or DEFAULT_LOG_FILE)
+
+    @contextmanager
+    def stage(self, name, rows=None, **info):
+        """Time the with-block; the yielded record can be updated inside it (e.g. record['rows'])."""
+        record = {'stage': name, 'rows': rows, **info}
+        sampler = _PeakSampler()
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record['error'] = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 4)
+            memory, peak = sampler.stop()
+            record['peak_mb'] = None if peak is None else round(peak, 1)
+            record['memory_mb'] = None if memory is None else round(memory, 1)
+            record['time'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            self.add(record)
+
+    def add_timed(self, name, seconds, rows=None, **info):
+        """Record a stage timed elsewhere (e.g. summed over the lists read), without memory figures."""
+        self.add({'stage': name, 'rows': rows, **info, 'seconds': round(seconds, 4), 'peak_mb': None,
+                  'memory_mb': None, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')})
+
+    def add(self, record):
+        self.records.append(record)
+        if self.log_file:
+            try:
+                with open(self.log_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, default=str) + '\n')
+            except OSError:
+                pass  # the log must never stop a comparison
+
+    def describe(self, records):
+        """One line for the status bar: each stage with its time and rows, then the highest stage peak."""
+        parts = []
+        for record in records:
+            part = f"{STAGE_LABELS.get(record['stage'], record['stage'])} {record['seconds']:.2f} s"
+            if record.get('rows') is not None:
+                part += f" ({record['rows']:,} righe)"
+            parts.append(part)
+        peaks = [r['peak_mb'] for r in records if r.get('peak_mb') is not None]
+        if peaks:
+            parts.append(f'picco memoria {max(peaks):,.0f} MB')
+        return ', '.join(parts)
+
+
+@contextmanager
+def measure(metrics, name, rows=None):
+    """metrics.stage(name, rows), or a record that is thrown away when metrics is None."""
+    if metrics is None:
+        yield {'stage': name, 'rows': rows}
+    else:
+        with metrics.stage(name, rows) as record:
+            yield record
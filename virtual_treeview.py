@@ -0,0 +1,139 @@
+from tkinter import ttk
+
+HEADING_HEIGHT = 25
+
+
+class VirtualTreeview(ttk.Treeview):
+    """
+    Treeview that only holds the rows currently visible. The data stays in a
+    Python-side model: get_row(index) must return (values, tags) for a row.
+    Item ids are the row indexes as strings, so identify_row()/selection()
+    can be mapped back to the model with index_of().
+    Use attach_yscrollbar() instead of yscrollcommand: the vertical scrollbar
+    is driven by the position in the model, not by the inserted rows.
+    """
+
+    def __init__(self, master, get_row, row_count=0, **kw):
+        super().__init__(master, **kw)
+        self.get_row = get_row
+        self.row_count = row_count
+        self.offset = 0
+        self.visible_rows = int(self.cget('height'))
+        self.selected_index = None
+        self.yscrollbar = None
+        self.bind('<Configure>', self._on_configure)
+        self.bind('<MouseWheel>', self._on_mousewheel)
+        self.bind('<Button-4>', lambda e: self._scroll_units(-3))
+        self.bind('<Button-5>', lambda e: self._scroll_units(3))
+        self.bind('<Up>', lambda e: self._move_selection(-1))
+        self.bind('<Down>', lambda e: self._move_selection(1))
+        self.bind('<Prior>', lambda e: self._move_selection(-self.visible_rows))
+        self.bind('<Next>', lambda e: self._move_selection(self.visible_rows))
+        self.bind('<<TreeviewSelect>>', self._on_select, add='+')
+
+    def attach_yscrollbar(self, scrollbar):
+        self.yscrollbar = scrollbar
+        scrollbar.configure(command=self.yview)
+        self._update_scrollbar()
+
+    def index_of(self, iid):
+        return int(iid)
+
+    def set_row_count(self, row_count):
+        self.row_count = row_count
+        self.offset = self._clamp(self.offset)
+        if self.selected_index is not None and self.selected_index >= row_count:
+            self.selected_index = None
+        self.refresh()
+
+    def refresh(self):
+        """Re-read the visible rows from the model."""
+        children = self.get_children()
+        if children:
+            self.delete(*children)
+        last = min(self.offset + self.visible_rows, self.row_count)
+        for index in range(self.offset, last):
+            values, tags = self.get_row(index)
+            self.insert('', 'end', iid=str(index), values=values, tags=tags)
+        if self.selected_index is not None and self.offset <= self.selected_index < last:
+            self.selection_set(str(self.selected_index))
+        self._update_scrollbar()
+
+    def refresh_row(self, index):
+        if self.exists(str(index)):
+            values, tags = self.get_row(index)
+            self.item(str(index), values=values, tags=tags)
+
+    def scroll_to(self, index):
+        """Scroll so that the model row index is visible."""
+        if index < self.offset:
+            self.offset = index
+        elif index >= self.offset + self.visible_rows:
+            self.offset = index - self.visible_rows + 1
+        else:
+            return
+        self.offset = self._clamp(self.offset)
+        self.refresh()
+
+    def select_index(self, index):
+        """Select and show the model row index (None clears the selection)."""
+        self.selected_index = index
+        if index is None:
+            self.selection_remove(self.selection())
+            return
+        self.scroll_to(index)
+        self.selection_set(str(index))
+        self.focus(str(index))
+
+    def yview(self, *args):
+        if not args:
+            return self._fractions()
+        if args[0] == 'moveto':
+            self.offset = self._clamp(int(float(args[1]) * self.row_count))
+        elif args[0] == 'scroll':
+            step = int(args[1]) * (self.visible_rows if args[2] == 'pages' else 1)
+            self.offset = self._clamp(self.offset + step)
+        self.refresh()
+
+    def _clamp(self, offset):
+        return max(0, min(offset, self.row_count - self.visible_rows))
+
+    def _fractions(self):
+        if self.row_count <= 0:
+            return 0.0, 1.0
+        return self.offset / self.row_count, min(1.0, (self.offset + self.visible_rows) / self.row_count)
+
+    def _update_scrollbar(self):
+        if self.yscrollbar is not None:
+            self.yscrollbar.set(*self._fractions())
+
+    def _on_configure(self, event):
+        row_height = ttk.Style().lookup('Treeview', 'rowheight') or 20
+        visible_rows = max(1, (event.height - HEADING_HEIGHT) // int(row_height))
+        if visible_rows != self.visible_rows:
+            self.visible_rows = visible_rows
+            self.offset = self._clamp(self.offset)
+            self.refresh()
+
+    def _on_mousewheel(self, event):
+        self._scroll_units(-3 if event.delta > 0 else 3)
+        return 'break'
+
+    def _scroll_units(self, units):
+        self.yview('scroll', units, 'units')
+        return 'break'
+
+    def _on_select(self, event=None):
+        selection = self.selection()
+        if selection:
+            self.selected_index = self.index_of(selection[0])
+
+    def _move_selection(self, step):
+        if not self.row_count:
+            return 'break'
+        if self.selected_index is None:
+            index = self.offset
+        else:
+            index = max(0, min(self.selected_index + step, self.row_count - 1))
+        self.select_index(index)
+        return 'break'